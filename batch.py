@@ -0,0 +1,43 @@
+"""
+Converts a directory (or zip) of panel SVGs into a zip of KiCad PCBs
+"""
+import argparse
+import os.path
+import sys
+
+from panelizer.batch import (
+    PENDING_PER_WORKER,
+    convert_batch,
+    create_executor,
+    read_directory,
+    read_zip,
+    write_zip,
+)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("input", help="directory or zip file containing SVG panels")
+    parser.add_argument("-o", "--output", default="panels.zip")
+    parser.add_argument(
+        "-j", "--workers", type=int, default=None, help="defaults to the CPU count"
+    )
+    args = parser.parse_args()
+
+    if os.path.isdir(args.input):
+        files = read_directory(args.input)
+    else:
+        files = read_zip(args.input)
+
+    with create_executor(args.workers) as executor:
+        max_pending = args.workers and PENDING_PER_WORKER * args.workers
+        failed = write_zip(convert_batch(files, executor, max_pending), args.output)
+
+    for result in failed:
+        print(f"{result.path}: {result.error}", file=sys.stderr)
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
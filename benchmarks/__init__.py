@@ -0,0 +1,3 @@
+"""
+Benchmarks and checks run from the repository root with `python -m benchmarks.<name>`
+"""
@@ -0,0 +1,294 @@
+"""
+Times create, update and convert on synthetic panels of every HP size
+
+Run from the repository root with `python -m benchmarks.bench`, results are
+written as JSON so that runs can be compared with `--compare`.
+"""
+import argparse
+import datetime
+import json
+import math
+import multiprocessing
+import platform
+import random
+import resource
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+from typing import Callable, NamedTuple
+
+from lxml import etree
+from lxml.etree import SubElement
+
+from panelizer.convert import (
+    CONVERTED_LAYERS,
+    PCB,
+    STAGES,
+    convert,
+    inline_symbols,
+    split_layers,
+)
+from panelizer.create import HP_TO_MM, NS, SYMBOLS, create, inkscape, xlink
+from panelizer.update import update
+
+
+class Profile(NamedTuple):
+    # symbol <use> instances per HP
+    symbols: float
+    # closed bezier shapes drawn on the Front layer
+    artwork: int
+    # segments per artwork shape
+    complexity: int
+    # extra paths, holes and slots on the Cuts layer
+    cuts: int
+
+
+PROFILES = {
+    "empty": Profile(symbols=0, artwork=0, complexity=0, cuts=0),
+    "typical": Profile(symbols=0.5, artwork=10, complexity=8, cuts=2),
+    "heavy": Profile(symbols=2, artwork=80, complexity=32, cuts=12),
+}
+
+
+def find_layer(root: etree._Element, label: str) -> etree._Element:
+    return root.xpath(
+        f"//svg:g[@inkscape:label='{label}']",
+        namespaces={"svg": NS.svg, "inkscape": NS.inkscape},
+    )[0]
+
+
+def blob(rng: random.Random, cx: float, cy: float, r: float, segments: int) -> str:
+    points = []
+    for i in range(segments):
+        angle = 2 * math.pi * i / segments
+        radius = r * rng.uniform(0.5, 1)
+        points.append((cx + radius * math.cos(angle), cy + radius * math.sin(angle)))
+
+    d = [f"M {points[0][0]:.3f} {points[0][1]:.3f}"]
+    for (x1, y1), (x2, y2) in zip(points, points[1:] + points[:1]):
+        d.append(
+            f"C {x1 + rng.uniform(-r, r) / 4:.3f} {y1 + rng.uniform(-r, r) / 4:.3f} "
+            f"{x2 + rng.uniform(-r, r) / 4:.3f} {y2 + rng.uniform(-r, r) / 4:.3f} "
+            f"{x2:.3f} {y2:.3f}"
+        )
+    return " ".join(d) + " Z"
+
+
+def synthetic_panel(hp: int, profile: Profile, seed: int = 0) -> bytes:
+    rng = random.Random(seed)
+    svg = etree.parse(create(hp, f"Bench {hp}HP"))
+    root = svg.getroot()
+    width, height = HP_TO_MM[hp], 128.5
+
+    def random_point(margin: float) -> tuple[float, float]:
+        return (
+            rng.uniform(margin, max(width - margin, margin)),
+            rng.uniform(12 + margin, height - 12 - margin),
+        )
+
+    symbol_ids = [symbol.get("id") for symbol in SYMBOLS.symbols()]
+    components = find_layer(root, "Components")
+    for i in range(round(profile.symbols * hp)):
+        x, y = random_point(5)
+        SubElement(
+            components,
+            "use",
+            attrib={
+                xlink("href"): f"#{rng.choice(symbol_ids)}",
+                inkscape("label"): f"Component {i}",
+                "transform": f"translate({x - 5},{y - 5})",
+            },
+        )
+
+    front = find_layer(root, "Front")
+    for i in range(profile.artwork):
+        x, y = random_point(3)
+        if i % 4 == 0:
+            SubElement(
+                front,
+                "text",
+                attrib={
+                    "x": str(x),
+                    "y": str(y),
+                    "fill": "#fff",
+                    "style": "font-size:1.5mm;font-family:'Jost*',Jost;",
+                },
+            ).text = f"LABEL {i}"
+        else:
+            SubElement(
+                front,
+                "path",
+                attrib={
+                    "d": blob(rng, x, y, rng.uniform(1, 4), profile.complexity),
+                    "fill": "#fff",
+                },
+            )
+
+    cuts = find_layer(root, "Cuts")
+    for i in range(profile.cuts):
+        x, y = random_point(6)
+        match i % 3:
+            case 0:
+                SubElement(
+                    cuts,
+                    "circle",
+                    attrib={"cx": str(x), "cy": str(y), "r": "1.6", "fill": "#000"},
+                )
+            case 1:
+                SubElement(
+                    cuts,
+                    "rect",
+                    attrib={
+                        "x": str(x - 1),
+                        "y": str(y - 3),
+                        "width": "2",
+                        "height": "6",
+                        "ry": "3",
+                        "fill": "#000",
+                    },
+                )
+            case 2:
+                SubElement(
+                    cuts,
+                    "path",
+                    attrib={"d": blob(rng, x, y, 4, 12), "fill": "#000"},
+                )
+
+    return etree.tostring(svg)
+
+
+def measure(fn: Callable[[], object]) -> dict[str, float]:
+    wall, cpu = time.perf_counter(), time.process_time()
+    fn()
+    return {
+        "wall": time.perf_counter() - wall,
+        "cpu": time.process_time() - cpu,
+    }
+
+
+def peak_rss() -> int:
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return rss if sys.platform == "darwin" else rss * 1024
+
+
+def run_case(hp: int, profile_name: str, convert_panels: bool) -> dict:
+    """Runs in its own process so that the peak RSS belongs to this case"""
+    profile = PROFILES[profile_name]
+    panel = synthetic_panel(hp, profile)
+    timings = {
+        "create": measure(lambda: create(hp, "Bench")),
+        "update": measure(lambda: update(BytesIO(panel))),
+    }
+
+    if convert_panels:
+        svg = etree.parse(BytesIO(panel))
+        timings["inline_symbols"] = measure(lambda: inline_symbols(svg.getroot()))
+
+        layers = {}
+        timings["split_layers"] = measure(
+            lambda: layers.update(split_layers(svg.getroot(), CONVERTED_LAYERS))
+        )
+
+        pcb = PCB(title="Bench")
+        for add_layer in STAGES.values():
+            timings[add_layer.__name__] = measure(
+                # pylint: disable-next=cell-var-from-loop
+                lambda: add_layer(pcb, svg, layers)
+            )
+        timings["write"] = measure(lambda: b"".join(pcb.iter_write()))
+
+        timings["convert"] = measure(lambda: convert(BytesIO(panel), "Bench"))
+
+    return {
+        "hp": hp,
+        "profile": profile_name,
+        **profile._asdict(),
+        "svg_size": len(panel),
+        "timings": timings,
+        "peak_rss": peak_rss(),
+    }
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, check=True, text=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare(previous_path: str, results: dict) -> None:
+    with open(previous_path, encoding="utf-8") as fh:
+        previous = {
+            (case["hp"], case["profile"]): case for case in json.load(fh)["cases"]
+        }
+
+    for case in results["cases"]:
+        before = previous.get((case["hp"], case["profile"]))
+        if before is None:
+            continue
+        for name, timing in case["timings"].items():
+            if name not in before["timings"]:
+                continue
+            ratio = timing["wall"] / max(before["timings"][name]["wall"], 1e-9)
+            print(
+                f"{case['hp']:>3}HP {case['profile']:<8} {name:<26} "
+                f"{before['timings'][name]['wall']:9.4f}s -> {timing['wall']:9.4f}s "
+                f"({ratio:.2f}x)"
+            )
+        print(
+            f"{case['hp']:>3}HP {case['profile']:<8} {'peak_rss':<26} "
+            f"{before['peak_rss'] / 2**20:8.1f}MB -> {case['peak_rss'] / 2**20:8.1f}MB"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--hp", type=int, nargs="*", default=list(HP_TO_MM), choices=list(HP_TO_MM)
+    )
+    parser.add_argument(
+        "--profile", nargs="*", default=list(PROFILES), choices=list(PROFILES)
+    )
+    parser.add_argument(
+        "--no-convert",
+        action="store_true",
+        help="only time create and update",
+    )
+    parser.add_argument("-o", "--output", default="bench.json")
+    parser.add_argument("--compare", help="previous results to compare against")
+    args = parser.parse_args()
+
+    cases = []
+    for hp in args.hp:
+        for profile in args.profile:
+            with ProcessPoolExecutor(
+                1, mp_context=multiprocessing.get_context("spawn")
+            ) as executor:
+                case = executor.submit(
+                    run_case, hp, profile, not args.no_convert
+                ).result()
+            cases.append(case)
+            total = sum(timing["wall"] for timing in case["timings"].values())
+            print(f"{hp:>3}HP {profile:<8} {total:9.3f}s", file=sys.stderr)
+
+    results = {
+        "date": datetime.datetime.now().isoformat(),
+        "revision": git_revision(),
+        "python": sys.version,
+        "platform": platform.platform(),
+        "cases": cases,
+    }
+    with open(args.output, "w", encoding="utf-8") as fh:
+        json.dump(results, fh, indent=2)
+
+    if args.compare:
+        compare(args.compare, results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+Measures the imports a server makes before its first request with
+`python -X importtime`, and checks that the conversion stack isn't among them
+
+Run from the repository root with `python -m benchmarks.importtime`, exits with
+an error when a module that should load lazily is imported at startup, or when
+the imports take longer than `--max-ms`.
+"""
+import argparse
+import os
+import subprocess
+import sys
+from typing import NamedTuple
+
+STARTUP = "import panelizer; panelizer.create_app()"
+
+# Only imported with the first conversion, or by PANELIZER_PREWARM
+LAZY = [
+    "panelizer.convert",
+    "panelizer.raster",
+    "panelizer.rasterizers",
+    "panelizer.cost",
+    "cairocffi",
+    "cairosvg",
+    "cssutils",
+    "gingerbread",
+    "pyvips",
+    "sassutils",
+    "svgelements",
+]
+
+
+class Import(NamedTuple):
+    module: str
+    # microseconds spent importing the module alone, and with its own imports
+    self_us: int
+    cumulative_us: int
+
+
+def measure() -> list[Import]:
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", STARTUP],
+        capture_output=True,
+        text=True,
+        check=True,
+        env={**os.environ, "PANELIZER_PREWARM": "0"},
+    )
+
+    imports = []
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, module = line.removeprefix("import time:").split("|")
+        imports.append(Import(module.strip(), int(self_us), int(cumulative_us)))
+    return imports
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--max-ms",
+        type=float,
+        default=None,
+        help="fail when the startup imports take longer than this",
+    )
+    parser.add_argument("--top", type=int, default=15, help="slowest imports to list")
+    args = parser.parse_args()
+
+    imports = measure()
+    total_ms = sum(entry.self_us for entry in imports) / 1000
+
+    for entry in sorted(imports, key=lambda entry: -entry.cumulative_us)[: args.top]:
+        print(
+            f"{entry.module:<40} {entry.self_us / 1000:8.1f}ms "
+            f"{entry.cumulative_us / 1000:8.1f}ms"
+        )
+    print(f"{'total':<40} {total_ms:8.1f}ms")
+
+    eager = sorted(
+        {
+            entry.module
+            for entry in imports
+            if any(
+                entry.module == module or entry.module.startswith(f"{module}.")
+                for module in LAZY
+            )
+        }
+    )
+    failed = False
+    if eager:
+        print(f"FAIL imported at startup: {', '.join(eager)}")
+        failed = True
+    if args.max_ms is not None and total_ms > args.max_ms:
+        print(f"FAIL startup imports took more than {args.max_ms:g}ms")
+        failed = True
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,78 @@
+"""
+Compares the bitmaps each rasterizer traces against cairosvg's for every layer
+of every symbol in the library
+
+Run from the repository root with `python -m benchmarks.parity`, exits with an
+error when a rasterizer differs from cairosvg by more than the tolerance.
+"""
+import argparse
+import os
+import sys
+
+import numpy as np
+from lxml import etree
+
+from panelizer.convert import split_layers
+from panelizer.create import SYMBOLS
+from panelizer.rasterizers import RASTERIZERS, CairoRasterizer, Rasterizer
+
+# (inkscape label, force fill, invert) of the layers rendered when converting
+LAYERS = [("Cuts", True, True), ("Relief", False, True), ("Front", False, False)]
+
+
+def bitmap(rasterizer: Rasterizer, svg: bytes, dpi: float, invert: bool):
+    return rasterizer.mask(rasterizer.render(svg, dpi=dpi, invert=invert))
+
+
+def difference(reference: np.ndarray, other: np.ndarray) -> float:
+    """Pixels that differ, relative to the pixels painted in either bitmap"""
+    height = min(reference.shape[0], other.shape[0])
+    width = min(reference.shape[1], other.shape[1])
+    reference, other = reference[:height, :width], other[:height, :width]
+    painted = np.count_nonzero(reference | other)
+    return np.count_nonzero(reference != other) / max(painted, 1)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--dpi", type=float, default=1270)
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.01,
+        help="largest fraction of painted pixels that may differ",
+    )
+    args = parser.parse_args()
+
+    reference = CairoRasterizer()
+    others = [
+        rasterizer()
+        for name, rasterizer in RASTERIZERS.items()
+        if name != reference.name
+    ]
+
+    failed = False
+    for symbol_file, _ in SYMBOLS.scan():
+        root = etree.parse(os.path.join(SYMBOLS.directory, symbol_file)).getroot()
+        layers = split_layers(root, [(label, fill) for label, fill, _ in LAYERS])
+        for label, fill, invert in LAYERS:
+            layer = layers[(label, fill)]
+            if layer is None:
+                continue
+
+            svg = etree.tostring(layer)
+            expected = bitmap(reference, svg, args.dpi, invert)
+            for other in others:
+                ratio = difference(expected, bitmap(other, svg, args.dpi, invert))
+                failed |= ratio > args.tolerance
+                print(
+                    f"{symbol_file:<32} {label:<8} {other.name:<10} "
+                    f"{ratio * 100:6.2f}% differ"
+                    + (" FAIL" if ratio > args.tolerance else "")
+                )
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
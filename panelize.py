@@ -0,0 +1,67 @@
+"""
+Tiles panel SVGs into a single KiCad PCB, identical panels are converted once
+"""
+import argparse
+import os.path
+import sys
+
+from panelizer.admission import TooExpensive, Unreadable, from_environment
+from panelizer.batch import create_executor
+from panelizer.panelize import Layout, Module, panelize
+
+
+def module(argument: str) -> Module:
+    # path[:count]
+    path, _, count = argument.rpartition(":")
+    if not path or not count.isdigit():
+        path, count = argument, "1"
+
+    with open(path, "rb") as fh:
+        svg = fh.read()
+    return Module(os.path.splitext(os.path.basename(path))[0], svg, int(count))
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "modules",
+        nargs="+",
+        type=module,
+        help="SVG panels, each optionally followed by :COUNT copies",
+    )
+    parser.add_argument("-o", "--output", default="panel.kicad_pcb")
+    parser.add_argument("-n", "--name", default="Panel")
+    parser.add_argument(
+        "--spacing", type=float, default=2.0, help="gap between panels in mm"
+    )
+    parser.add_argument(
+        "--max-width", type=float, default=None, help="wrap rows past this width in mm"
+    )
+    parser.add_argument(
+        "-j", "--workers", type=int, default=None, help="defaults to the CPU count"
+    )
+    args = parser.parse_args()
+
+    # Panels are converted within PANELIZER_ADMISSION_BUDGET, as on the server
+    with create_executor(args.workers) as executor:
+        try:
+            board = panelize(
+                args.modules,
+                args.name,
+                Layout(spacing=args.spacing, max_width=args.max_width),
+                executor,
+                from_environment(),
+            )
+        except (TooExpensive, Unreadable) as error:
+            print(error, file=sys.stderr)
+            return 1
+
+    with open(args.output, "wb") as fh:
+        for chunk in board.iter_write():
+            fh.write(chunk)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,61 +1,343 @@
+import contextlib
 import datetime
+import itertools
+import os
+import threading
+import unicodedata
+from io import BytesIO
+from typing import NamedTuple, Optional
+from urllib.parse import quote
 
-from flask import Flask, render_template, request, send_file
-from sassutils.wsgi import SassMiddleware
+from flask import (
+    Flask,
+    Response,
+    abort,
+    render_template,
+    request,
+    send_file,
+    stream_with_context,
+    url_for,
+)
+from werkzeug.http import dump_options_header
 
-from .convert import convert
-from .create import HP_TO_MM, create
-from .update import update
+from .admission import Admission, Busy, TooExpensive, Unreadable, from_environment
+from .batch import convert_batch, prewarm, read_zip, shared_executor, write_zip
+from .cache import TraceCache
+from .create import HP_TO_MM, SYMBOLS, create_document, precompute
+from .jobs import JobQueue, QueueFull
+from .metrics import REGISTRY, TIMINGS, count_output, server_timing, timed
+from .pool import RestartingPool
+from .update import iter_update
 
 __version__ = datetime.datetime.now().strftime("%Y.%m.%d.%H%M")
 
 
-def create_app() -> Flask:
-    app = Flask(__name__)
+def attachment(download_name: str) -> str:
+    # Same Content-Disposition send_file() would produce for the file name
+    try:
+        download_name.encode("ascii")
+    except UnicodeEncodeError:
+        simple = unicodedata.normalize("NFKD", download_name)
+        simple = simple.encode("ascii", "ignore").decode("ascii")
+        quoted = quote(download_name, safe="!#$&+^`|~")
+        names = {"filename": simple, "filename*": f"UTF-8''{quoted}"}
+    else:
+        names = {"filename": download_name}
 
-    if app.debug:
-        app.wsgi_app = SassMiddleware(
-            app.wsgi_app,
-            {__name__: ("static/scss", "static/css", "/static/css", False)},
+    return dump_options_header("attachment", names)
+
+
+def convert_panel(*args, **kwargs):
+    # The conversion stack (cairosvg, svgelements, gingerbread...) is only
+    # imported with the first conversion, or by prewarm()
+    from .convert import convert_panel as convert
+
+    return convert(*args, **kwargs)
+
+
+class Conversions(NamedTuple):
+    """How the server converts panels, as configured by the environment"""
+
+    # Opt-in pool tracing the Front, B.Cu and F.Cu layers of a conversion in
+    # parallel, replaced when one of its workers dies
+    layer_executor: Optional[RestartingPool]
+    trace_cache: Optional[TraceCache]
+    # Conversions wait until their predicted memory fits next to the running
+    # ones, those that can never fit are rejected up front.
+    admission: Optional[Admission]
+    admission_timeout: float
+    # Boards are written with UUIDs derived from their content, so converting
+    # the same panel always gives the same file and /convert can be revalidated.
+    deterministic: bool
+    # The batch pool is only started by the first /batch request
+    batch_workers: Optional[int]
+
+    def convert_panel(self, stream: BytesIO, name: str, **kwargs):
+        return convert_panel(
+            stream,
+            name,
+            executor=self.layer_executor,
+            cache=self.trace_cache,
+            deterministic=self.deterministic,
+            **kwargs,
         )
 
+
+def layer_executor_from_environment() -> Optional[RestartingPool]:
+    layer_workers = int(os.environ.get("PANELIZER_LAYER_WORKERS", 0))
+    if layer_workers <= 0:
+        return None
+
+    return RestartingPool(layer_workers)
+
+
+def trace_cache_from_environment() -> Optional[TraceCache]:
+    trace_cache_size = int(
+        os.environ.get("PANELIZER_TRACE_CACHE_SIZE", 64 * 1024 * 1024)
+    )
+    if trace_cache_size <= 0:
+        return None
+
+    return TraceCache(
+        trace_cache_size,
+        directory=os.environ.get("PANELIZER_TRACE_CACHE_DIR"),
+        max_disk_size=int(
+            os.environ.get("PANELIZER_TRACE_CACHE_DISK_SIZE", 1024 * 1024 * 1024)
+        ),
+    )
+
+
+def conversions_from_environment() -> Conversions:
+    return Conversions(
+        layer_executor=layer_executor_from_environment(),
+        trace_cache=trace_cache_from_environment(),
+        admission=from_environment(),
+        admission_timeout=float(os.environ.get("PANELIZER_ADMISSION_TIMEOUT", 30)),
+        deterministic=os.environ.get("PANELIZER_DETERMINISTIC", "1") != "0",
+        batch_workers=int(os.environ.get("PANELIZER_BATCH_WORKERS", 0)) or None,
+    )
+
+
+def add_monitoring(app: Flask) -> None:
+    @app.before_request
+    def start_timings():
+        TIMINGS.set([])
+
+    @app.after_request
+    def add_server_timing(response: Response):
+        timings = TIMINGS.get()
+        if timings:
+            response.headers["Server-Timing"] = server_timing(timings)
+        return response
+
+    @app.errorhandler(TooExpensive)
+    def too_expensive(error: TooExpensive):
+        return {"error": str(error)}, 413
+
+    @app.errorhandler(Unreadable)
+    def unreadable(error: Unreadable):
+        return {"error": str(error)}, 400
+
+    @app.errorhandler(Busy)
+    def busy(_error: Busy):
+        return (
+            {"error": "Too many conversions in progress, try again later"},
+            503,
+            {"Retry-After": "30"},
+        )
+
+    @app.get("/metrics")
+    def metrics_endpoint():
+        return Response(REGISTRY.render(), mimetype="text/plain; version=0.0.4")
+
+
+def add_document_endpoints(app: Flask) -> None:
     @app.get("/")
     def home_endpoint():
         return render_template("index.html", hp_sizes=list(HP_TO_MM.keys()), symbols={})
 
-    @app.post("/create")
+    @app.route("/create", methods=["GET", "POST"])
     def create_endpoint():
-        hp = request.form.get("hp", 12, type=int)
-        name = request.form.get("name", "Untitled Module", type=str)
+        hp = request.values.get("hp", 12, type=int)
+        name = request.values.get("name", "Untitled Module", type=str)
 
+        document = create_document(hp=hp, name=name)
+        count_output("svg", len(document.content))
+
+        # GET requests carrying a matching If-None-Match get a 304
         return send_file(
-            create(hp=hp, name=name),
+            BytesIO(document.content),
             mimetype="image/svg+xml",
             as_attachment=True,
             download_name="panel.svg",
+            etag=document.etag,
         )
 
     @app.post("/update")
     def update_endpoint():
         input_file = request.files.get("file")
 
-        return send_file(
-            update(input_file.stream),
+        def write():
+            size = 0
+            # Runs once the headers are sent, so only /metrics sees this stage
+            with timed("update"):
+                for chunk in iter_update(input_file.stream):
+                    size += len(chunk)
+                    yield chunk
+            count_output("svg", size)
+
+        # The upload is read while the response is sent, the first chunk is
+        # pulled here so that files that aren't XML at all fail with a 500.
+        output = stream_with_context(write())
+        first = next(output, b"")
+
+        return Response(
+            itertools.chain([first], output),
             mimetype="image/svg+xml",
-            as_attachment=True,
-            download_name=input_file.filename,
+            headers={"Content-Disposition": attachment(input_file.filename)},
         )
 
+
+def add_conversion_endpoints(app: Flask, conversions: Conversions) -> None:
     @app.post("/convert")
     def convert_endpoint():
         input_file = request.files.get("file")
         name = input_file.filename.removesuffix(".svg")
+        svg = input_file.stream.read()
+
+        from .convert import conversion_etag
+        from .cost import estimate
+
+        etag = conversion_etag(svg, name) if conversions.deterministic else None
+        if etag is not None and request.if_none_match.contains(etag):
+            response = Response(status=304)
+            response.set_etag(etag)
+            return response
+
+        admitted = (
+            contextlib.nullcontext()
+            if conversions.admission is None
+            else conversions.admission.admit(
+                estimate(svg), name, timeout=conversions.admission_timeout
+            )
+        )
+        with admitted:
+            panel = conversions.convert_panel(BytesIO(svg), name)
+
+        def write():
+            size = 0
+            # Runs once the headers are sent, so only /metrics sees this stage
+            with timed("write"):
+                for chunk in panel.iter_write():
+                    size += len(chunk)
+                    yield chunk
+            count_output("kicad_pcb", size)
+
+        response = Response(
+            write(),
+            mimetype="application/x-kicad-pcb",
+            headers={"Content-Disposition": attachment(f"{name}.kicad_pcb")},
+        )
+        if etag is not None:
+            response.set_etag(etag)
+        return response
+
+    @app.post("/batch")
+    def batch_endpoint():
+        input_file = request.files.get("file")
+        name = input_file.filename.removesuffix(".zip")
+
+        output = BytesIO()
+        results = convert_batch(
+            read_zip(input_file.stream),
+            shared_executor(conversions.batch_workers),
+            admission=conversions.admission,
+        )
+        write_zip(results, output)
+        output.seek(0)
+
+        return send_file(
+            output,
+            mimetype="application/zip",
+            as_attachment=True,
+            download_name=f"{name}.zip",
+        )
+
+
+def add_job_endpoints(app: Flask, job_queue: JobQueue) -> None:
+    @app.post("/jobs")
+    def submit_job_endpoint():
+        input_file = request.files.get("file")
+        name = input_file.filename.removesuffix(".svg")
+
+        try:
+            job = job_queue.submit(input_file.stream.read(), name)
+        except QueueFull:
+            return (
+                {"error": "Too many conversions in progress, try again later"},
+                503,
+                {"Retry-After": "30"},
+            )
+
+        return (
+            job.to_dict(),
+            202,
+            {"Location": url_for("job_endpoint", job_id=job.id)},
+        )
+
+    @app.get("/jobs/<job_id>")
+    def job_endpoint(job_id: str):
+        job = job_queue.get(job_id)
+        if job is None:
+            abort(404)
+
+        return job.to_dict()
+
+    @app.get("/jobs/<job_id>/download")
+    def download_job_endpoint(job_id: str):
+        job = job_queue.get(job_id)
+        if job is None:
+            abort(404)
+        if job.status != "done":
+            return job.to_dict(), 409
 
         return send_file(
-            convert(input_file.stream, name),
+            job.result_path,
             mimetype="application/x-kicad-pcb",
             as_attachment=True,
-            download_name=f"{name}.kicad_pcb",
+            download_name=f"{job.name}.kicad_pcb",
         )
 
+
+def create_app() -> Flask:
+    app = Flask(__name__)
+
+    conversions = conversions_from_environment()
+    job_queue = JobQueue(
+        conversions.convert_panel,
+        workers=int(os.environ.get("PANELIZER_JOB_WORKERS", 2)),
+        max_pending=int(os.environ.get("PANELIZER_JOB_QUEUE_DEPTH", 16)),
+        directory=os.environ.get("PANELIZER_JOB_DIR"),
+        admission=conversions.admission,
+    )
+
+    if app.debug:
+        from sassutils.wsgi import SassMiddleware
+
+        app.wsgi_app = SassMiddleware(
+            app.wsgi_app,
+            {__name__: ("static/scss", "static/css", "/static/css", False)},
+        )
+        SYMBOLS.watch = True
+
+    precompute()
+
+    if os.environ.get("PANELIZER_PREWARM", "0") != "0":
+        threading.Thread(target=prewarm, name="prewarm", daemon=True).start()
+
+    add_monitoring(app)
+    add_document_endpoints(app)
+    add_conversion_endpoints(app, conversions)
+    add_job_endpoints(app, job_queue)
+
     return app
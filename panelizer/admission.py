@@ -0,0 +1,148 @@
+"""
+Admits conversions against a global memory budget using their predicted cost
+"""
+import contextlib
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Executor, Future
+from typing import TYPE_CHECKING, Callable, Iterator, Optional
+
+from .metrics import RSS_SAMPLER, count_admission, count_rejected
+
+if TYPE_CHECKING:
+    from .cost import Estimate
+
+logger = logging.getLogger(__name__)
+
+MIB = 1024 * 1024
+
+
+class TooExpensive(Exception):
+    """The conversion is predicted to need more than the whole budget"""
+
+    def __init__(self, estimate: "Estimate", cost: str):
+        super().__init__(
+            f"Converting this {estimate.width:g}x{estimate.height:g}mm panel with "
+            f"{estimate.nodes} elements would {cost}"
+        )
+        self.estimate = estimate
+
+
+class Busy(Exception):
+    """The conversion didn't fit next to the running ones in time"""
+
+
+class Unreadable(Exception):
+    """The document can't be parsed, so its cost can't be predicted"""
+
+
+class Admission:
+    """
+    Runs conversions only while the sum of their predicted memory stays
+    within `budget` bytes, the others wait for running ones to finish.
+    Conversions predicted to take longer than `max_seconds` aren't run at all.
+    """
+
+    def __init__(self, budget: int, max_seconds: Optional[float] = None):
+        self.budget = budget
+        self.max_seconds = max_seconds
+        self.in_use = 0
+        self.condition = threading.Condition()
+
+    def check(self, estimate: "Estimate") -> None:
+        if estimate.memory > self.budget:
+            count_rejected("memory")
+            raise TooExpensive(
+                estimate,
+                f"need about {estimate.memory // MIB}MiB, more than the "
+                f"{self.budget // MIB}MiB available",
+            )
+        if self.max_seconds is not None and estimate.seconds > self.max_seconds:
+            count_rejected("time")
+            raise TooExpensive(
+                estimate,
+                f"take about {estimate.seconds:.0f}s, longer than the "
+                f"{self.max_seconds:g}s allowed",
+            )
+
+    @contextlib.contextmanager
+    def admit(
+        self, estimate: "Estimate", name: str, timeout: Optional[float] = None
+    ) -> Iterator[None]:
+        """
+        Waits up to `timeout` seconds (forever when None) for room in the
+        budget, then logs the predicted and actual cost of the conversion run
+        within.
+        """
+        self.check(estimate)
+        with self.condition:
+            if not self.condition.wait_for(
+                lambda: self.in_use + estimate.memory <= self.budget,
+                timeout,
+            ):
+                count_rejected("busy")
+                raise Busy()
+            self.in_use += estimate.memory
+
+        wall, rss = time.perf_counter(), RSS_SAMPLER.start()
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.in_use -= estimate.memory
+                self.condition.notify_all()
+
+            seconds, memory = time.perf_counter() - wall, RSS_SAMPLER.stop(rss)
+            count_admission(estimate.memory, estimate.seconds, memory, seconds)
+            logger.info(
+                "converted %s: predicted %dMiB %.2fs, actual RSS %s %.2fs "
+                "(%gx%gmm, %d nodes, %d segments, %d image pixels)",
+                name,
+                estimate.memory // MIB,
+                estimate.seconds,
+                "shared" if memory is None else f"+{memory // MIB}MiB",
+                seconds,
+                estimate.width,
+                estimate.height,
+                estimate.nodes,
+                estimate.segments,
+                estimate.image_pixels,
+            )
+
+    def submit(
+        self,
+        executor: Executor,
+        estimate: "Estimate",
+        name: str,
+        fn: Callable,
+        *args,
+        timeout: Optional[float] = None,
+    ) -> Future:
+        """
+        Submits `fn(*args)` to `executor` once admitted like admit(), the
+        budget is given back when it finishes.
+        """
+        with contextlib.ExitStack() as stack:
+            stack.enter_context(self.admit(estimate, name, timeout))
+            future = executor.submit(fn, *args)
+            admitted = stack.pop_all()
+
+        future.add_done_callback(lambda _: admitted.close())
+        return future
+
+
+def from_environment() -> Optional[Admission]:
+    """
+    The scheduler configured by PANELIZER_ADMISSION_BUDGET and
+    PANELIZER_ADMISSION_MAX_SECONDS, None when admission control is disabled
+    """
+    budget = int(os.environ.get("PANELIZER_ADMISSION_BUDGET", 2 * 1024 * 1024 * 1024))
+    if budget <= 0:
+        return None
+
+    return Admission(
+        budget,
+        max_seconds=float(os.environ.get("PANELIZER_ADMISSION_MAX_SECONDS", 600)),
+    )
@@ -0,0 +1,227 @@
+"""
+Converts many panels at once on a pool of worker processes
+"""
+import json
+import os
+import os.path
+import threading
+import zipfile
+from collections import deque
+from concurrent.futures import Executor, Future, wait
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
+from typing import Callable, Iterator, NamedTuple, Optional
+
+from .admission import Admission
+from .pool import RestartingPool, is_broken
+
+# The conversion stack is imported by the functions using it, so that servers
+# only load it once they convert something, see prewarm().
+
+# Files converted or waiting for their turn on the pool at once, per worker
+PENDING_PER_WORKER = 2
+
+# A panel with a hole and some text on each traced layer
+WARMUP_PANEL = b"""<svg xmlns="http://www.w3.org/2000/svg"
+    xmlns:inkscape="http://www.inkscape.org/namespaces/inkscape"
+    xmlns:xlink="http://www.w3.org/1999/xlink"
+    width="10mm" height="10mm" viewBox="0 0 10 10">
+  <g inkscape:label="Cuts" inkscape:groupmode="layer">
+    <circle cx="5" cy="7" r="1" fill="none" stroke="#000" stroke-width="0.5"/>
+  </g>
+  <g inkscape:label="Relief" inkscape:groupmode="layer">
+    <text x="1" y="3" style="font-family:Jost;font-size:2px">mlon</text>
+  </g>
+  <g inkscape:label="Front" inkscape:groupmode="layer">
+    <text x="1" y="5" style="font-family:Jost;font-size:2px">mlon</text>
+  </g>
+</svg>"""
+
+
+class BatchResult(NamedTuple):
+    path: str
+    board: Optional[bytes]
+    error: Optional[str]
+
+
+class PendingFile(NamedTuple):
+    path: str
+    svg: bytes
+    future: Future
+
+
+def init_worker() -> None:
+    # Renders some text once so the rasterizer and fontconfig are set up
+    # before the first panel reaches this worker.
+    from .raster import render
+
+    render(
+        b'<svg xmlns="http://www.w3.org/2000/svg" width="1mm" height="1mm">'
+        b'<text style="font-family:Jost">mlon</text></svg>',
+        dpi=254,
+    )
+
+
+def create_executor(workers: Optional[int] = None) -> RestartingPool:
+    return RestartingPool(workers, initializer=init_worker)
+
+
+_shared_executors: dict[Optional[int], RestartingPool] = {}
+_shared_executors_lock = threading.Lock()
+
+
+def shared_executor(workers: Optional[int] = None) -> RestartingPool:
+    """A pool of `workers` shared by the callers asking for it, started on first use"""
+    with _shared_executors_lock:
+        if workers not in _shared_executors:
+            _shared_executors[workers] = create_executor(workers)
+        return _shared_executors[workers]
+
+
+def prewarm() -> None:
+    """
+    Imports the conversion stack and converts a tiny panel, so that the first
+    conversion a server runs is as fast as the next ones
+    """
+    from .convert import convert
+
+    convert(BytesIO(WARMUP_PANEL), "Warmup")
+
+
+def convert_file(path: str, svg: bytes) -> BatchResult:
+    from .convert import convert
+
+    name = os.path.splitext(os.path.basename(path))[0]
+    try:
+        return BatchResult(path, convert(BytesIO(svg), name).getvalue(), None)
+    # pylint: disable-next=broad-except
+    except Exception as error:
+        return BatchResult(path, None, f"{type(error).__name__}: {error}")
+
+
+def read_zip(stream) -> Iterator[tuple[str, bytes]]:
+    with zipfile.ZipFile(stream) as archive:
+        for info in archive.infolist():
+            if (
+                info.is_dir()
+                or not info.filename.lower().endswith(".svg")
+                or info.filename.startswith("__MACOSX/")
+            ):
+                continue
+            yield info.filename, archive.read(info)
+
+
+def read_directory(directory: str) -> Iterator[tuple[str, bytes]]:
+    for parent, _, files in sorted(os.walk(directory)):
+        for file in sorted(files):
+            if not file.lower().endswith(".svg"):
+                continue
+            path = os.path.join(parent, file)
+            with open(path, "rb") as fh:
+                yield os.path.relpath(path, directory), fh.read()
+
+
+def failed_file(path: str, error: Exception) -> BatchResult:
+    return BatchResult(path, None, f"{type(error).__name__}: {error}")
+
+
+def submit_file(
+    executor: Executor,
+    path: str,
+    svg: bytes,
+    admission: Optional[Admission] = None,
+    convert: Callable[[str, bytes], BatchResult] = convert_file,
+) -> Future:
+    try:
+        if admission is None:
+            return executor.submit(convert, path, svg)
+
+        from .cost import estimate
+
+        # Waits for as long as the budget is held by other conversions
+        return admission.submit(executor, estimate(svg), path, convert, path, svg)
+    # Files that can't be estimated, don't fit or find the pool broken fail
+    # pylint: disable-next=broad-except
+    except Exception as error:
+        future: Future = Future()
+        future.set_result(failed_file(path, error))
+        return future
+
+
+def file_result(path: str, future: Future) -> BatchResult:
+    try:
+        return future.result()
+    except BrokenProcessPool as error:
+        return failed_file(path, error)
+
+
+def convert_batch(
+    files: Iterator[tuple[str, bytes]],
+    executor: RestartingPool,
+    max_pending: Optional[int] = None,
+    admission: Optional[Admission] = None,
+    convert: Callable[[str, bytes], BatchResult] = convert_file,
+) -> Iterator[BatchResult]:
+    """
+    Converts `files` on `executor` in order, reading the next file only once
+    fewer than `max_pending` are converting or waiting to be written. With an
+    `admission`, each file is only submitted once it fits in the budget.
+
+    A worker that dies takes every file in flight on the pool with it. Those
+    are converted again on the pool that replaced it, except the first one,
+    which is converted on a worker of its own and only fails if it dies too.
+    """
+    if max_pending is None:
+        max_pending = PENDING_PER_WORKER * (os.cpu_count() or 1)
+
+    pending: deque[PendingFile] = deque()
+
+    def submit(path: str, svg: bytes, pool: Executor = executor) -> Future:
+        return submit_file(pool, path, svg, admission, convert)
+
+    def take() -> BatchResult:
+        path, svg, future = pending.popleft()
+        wait([future])
+        if not is_broken(future):
+            return file_result(path, future)
+
+        for index, other in enumerate(pending):
+            if is_broken(other.future):
+                pending[index] = other._replace(future=submit(other.path, other.svg))
+
+        alone = executor.alone()
+        try:
+            return file_result(path, submit(path, svg, alone))
+        finally:
+            alone.shutdown(wait=False)
+
+    for path, svg in files:
+        if len(pending) >= max_pending:
+            yield take()
+        pending.append(PendingFile(path, svg, submit(path, svg)))
+
+    while pending:
+        yield take()
+
+
+def write_zip(results: Iterator[BatchResult], output) -> list[BatchResult]:
+    """
+    Writes the converted boards, along with a report.json listing the outcome
+    of every file, returns the results that failed.
+    """
+    report = {}
+    failed = []
+    with zipfile.ZipFile(output, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        for result in results:
+            if result.board is not None:
+                archive.writestr(
+                    f"{os.path.splitext(result.path)[0]}.kicad_pcb", result.board
+                )
+                report[result.path] = {"status": "done"}
+            else:
+                report[result.path] = {"status": "failed", "error": result.error}
+                failed.append(result)
+
+        archive.writestr("report.json", json.dumps(report, indent=2))
+
+    return failed
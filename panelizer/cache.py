@@ -0,0 +1,145 @@
+"""
+Content addressed cache for traced layers
+"""
+import hashlib
+import os
+import os.path
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+
+def trace_key(
+    svg: bytes, layer: str, *, invert: bool, dpi: float, options: tuple = ()
+) -> str:
+    digest = hashlib.sha256(svg)
+    digest.update(f"\0{layer}\0{invert}\0{dpi}\0{options}".encode("utf-8"))
+    return digest.hexdigest()
+
+
+class TraceCache:
+    """
+    LRU cache of traced layers bounded by the total size of the cached traces,
+    optionally backed by a directory that outlives the process.
+    """
+
+    def __init__(
+        self,
+        max_size: int,
+        directory: Optional[str] = None,
+        max_disk_size: Optional[int] = None,
+    ):
+        self.max_size = max_size
+        self.directory = directory
+        self.max_disk_size = max_disk_size
+        self.size = 0
+        # Bytes this process believes are on disk, the directory is only
+        # scanned again once that goes over max_disk_size. Other processes
+        # sharing the directory are only accounted for by those scans.
+        self.disk_size: Optional[int] = None
+        self.entries: OrderedDict[str, str] = OrderedDict()
+        self.lock = threading.Lock()
+
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    def get(self, key: str) -> Optional[str]:
+        with self.lock:
+            value = self.entries.get(key)
+            if value is not None:
+                self.entries.move_to_end(key)
+                return value
+
+        value = self._read(key)
+        if value is not None:
+            self._remember(key, value)
+        return value
+
+    def put(self, key: str, value: str) -> None:
+        self._remember(key, value)
+        self._write(key, value)
+
+    def _remember(self, key: str, value: str) -> None:
+        if len(value) > self.max_size:
+            return
+
+        with self.lock:
+            if key in self.entries:
+                self.size -= len(self.entries.pop(key))
+
+            self.entries[key] = value
+            self.size += len(value)
+
+            while self.size > self.max_size:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.kicad_mod")
+
+    def _read(self, key: str) -> Optional[str]:
+        if self.directory is None:
+            return None
+
+        try:
+            with open(self._path(key), encoding="utf-8") as fh:
+                value = fh.read()
+        except FileNotFoundError:
+            return None
+
+        # mtime doubles as the last access time for disk eviction
+        try:
+            os.utime(self._path(key))
+        except FileNotFoundError:
+            # Evicted by another process since it was read
+            return None
+        return value
+
+    def _write(self, key: str, value: str) -> None:
+        if self.directory is None:
+            return
+
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        data = value.encode("utf-8")
+        with os.fdopen(fd, "wb") as fh:
+            fh.write(data)
+        size = len(data)
+        try:
+            size -= os.stat(self._path(key)).st_size
+        except FileNotFoundError:
+            pass
+        os.replace(tmp_path, self._path(key))
+
+        if self.max_disk_size is None:
+            return
+
+        with self.lock:
+            if self.disk_size is not None:
+                self.disk_size += size
+            over_budget = self.disk_size is None or self.disk_size > self.max_disk_size
+        if over_budget:
+            self._evict_disk()
+
+    def _evict_disk(self) -> None:
+        files = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".kicad_mod"):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_disk_size:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+        with self.lock:
+            self.disk_size = total
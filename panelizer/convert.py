@@ -1,25 +1,82 @@
 """
 Generates a KiCad PCB from an SVG file
 """
-import html
+import functools
+import hashlib
+import itertools
 import math
+import re
+import uuid
+from collections import Counter
+from concurrent.futures import Executor, Future
 from copy import deepcopy
-from io import BytesIO, StringIO
-from typing import Optional
+from importlib import metadata
+from io import SEEK_END, BytesIO, StringIO
+from typing import Callable, Iterator, Optional, Sequence
 
-import cairosvg
-import cairosvg.colors
-import cssutils
 import gingerbread._sexpr as s
 import gingerbread.pcb
-from gingerbread._geometry import bezier_to_points
-from gingerbread.trace import trace
 from lxml import etree
 from lxml.etree import QName
-from svgelements import SVG, Circle, CubicBezier, Line, Path, Rect
+from svgelements import SVG, Circle, Image, Path, Rect, Shape, Text
+
+from .cache import TraceCache, trace_key
+from .geometry import (
+    CURVE_TOLERANCE,
+    EPSILON,
+    ArcTo,
+    Outline,
+    distance,
+    path_outlines,
+)
+from .metrics import count_trace, timed
+from .page import DPI, MEMORY_BUDGET, MM_PER_INCH
+from .raster import (
+    Region,
+    Simplification,
+    content_regions,
+    layer_simplification,
+    trace_regions,
+    trace_regions_string,
+    trace_stacked,
+    trace_stacked_string,
+    trace_svg,
+    trace_svg_string,
+)
+from .rasterizers import RASTERIZER
+from .styles import recolor_style
+from .symbols import (
+    SYMBOL_ATTR,
+    UNMEASURED_ATTRIBUTES,
+    Placement,
+    place_instances,
+    select_shapes,
+)
 
 PADDING = 0.5
 
+# Blank page (in mm) between objects of the Front layer for them to be
+# rendered apart, and the area (in mm²) rendered for a batch of them before
+# the next batch starts.
+OBJECT_GAP = 1
+FRONT_BATCH_AREA = 100
+
+# Tokens of the points translate() moves, the drawings inside a footprint are
+# relative to its position and stay where they are.
+POINT_TOKENS = {"at", "start", "mid", "end", "center", "xy"}
+FOOTPRINT_AT = re.compile(r"\(at ([-0-9.e]+) ([-0-9.e]+)")
+TSTAMP = re.compile(r'\(tstamp "[0-9a-f-]+"\)')
+# Identifiers gingerbread draws at random for timestamps and edit stamps
+ITEM_UUID = re.compile(
+    r'"[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}"'
+)
+# Date of the title block, which gingerbread fixes when it's imported
+TITLE_DATE = re.compile(r'\(date "[0-9]+"\)')
+# Written instead when boards are written deterministically
+DETERMINISTIC_DATE = '(date "")'
+# Layers traced from rasters, whose output depends on their simplification
+TRACED_LAYERS = ["F.SilkS", "B.Cu", "F.Cu"]
+
 
 def gr_circle(
     *,
@@ -46,20 +103,222 @@ def gr_circle(
 s.gr_circle = gr_circle
 
 
+def translate(item, dx: float, dy: float):
+    """A copy of a board item moved by (dx, dy), with fresh timestamps"""
+    if isinstance(item, s.L):
+        # Traced layers are footprints serialized as a whole
+        text = TSTAMP.sub(lambda _: str(s.tstamp()), item.val)
+        return s.L(
+            FOOTPRINT_AT.sub(
+                lambda match: f"(at {float(match[1]) + dx} {float(match[2]) + dy}",
+                text,
+                count=1,
+            )
+        )
+
+    if not isinstance(item, s.S):
+        return item
+
+    if item.token == "tstamp":
+        return s.tstamp()
+    if item.token in POINT_TOKENS:
+        x, y, *rest = item.attributes
+        return s.S(item.token, x + dx, y + dy, *rest)
+    if item.token == "footprint":
+        # Positions within footprints are relative to their `at`
+        return s.S(
+            item.token,
+            *(
+                (
+                    translate(attribute, dx, dy)
+                    if isinstance(attribute, s.S) and attribute.token == "at"
+                    else fresh_tstamps(attribute)
+                )
+                for attribute in item.attributes
+            ),
+        )
+    return s.S(
+        item.token, *(translate(attribute, dx, dy) for attribute in item.attributes)
+    )
+
+
+def fresh_tstamps(item):
+    """A copy of a board item with fresh timestamps, in place"""
+    if isinstance(item, s.L):
+        return s.L(TSTAMP.sub(lambda _: str(s.tstamp()), item.val))
+    if not isinstance(item, s.S):
+        return item
+    if item.token == "tstamp":
+        return s.tstamp()
+    return s.S(item.token, *(fresh_tstamps(attribute) for attribute in item.attributes))
+
+
+def stable_ids(text: str, seed: str, seen: Counter) -> str:
+    """
+    A serialized item with its UUIDs derived from `seed` and the item itself,
+    items that are identical apart from their UUIDs are told apart by the
+    number of them `seen` before.
+    """
+    digest = hashlib.sha256(f"{seed}\0{ITEM_UUID.sub('', text)}".encode("utf-8"))
+    key = digest.digest()
+    occurrence = seen[key]
+    seen[key] += 1
+
+    namespace = uuid.UUID(bytes=key[:16])
+    ids = (
+        uuid.uuid5(namespace, f"{occurrence}:{index}") for index in itertools.count()
+    )
+    return ITEM_UUID.sub(lambda _: f'"{next(ids)}"', text)
+
+
+# Bumped with every change to the boards a conversion writes, so ETags handed
+# out by earlier versions no longer match
+CONVERSION_VERSION = 3
+
+# Distributions whose version changes the boards a conversion writes
+CONVERSION_LIBRARIES = (
+    "CairoSVG",
+    "gdstk",
+    "gingerbread",
+    "potracecffi",
+    "pyvips",
+    "svgelements",
+)
+
+
+@functools.cache
+def library_versions() -> tuple[tuple[str, Optional[str]], ...]:
+    versions = []
+    for library in CONVERSION_LIBRARIES:
+        try:
+            versions.append((library, metadata.version(library)))
+        except metadata.PackageNotFoundError:
+            versions.append((library, None))
+    return tuple(versions)
+
+
+def conversion_etag(svg: bytes, name: str) -> str:
+    """
+    Digest of everything a conversion depends on, `svg`, `name`, the settings
+    read from the environment and the versions of the converter and the
+    libraries it uses.
+    """
+    digest = hashlib.sha256(svg)
+    settings = (
+        name,
+        CONVERSION_VERSION,
+        library_versions(),
+        RASTERIZER.name,
+        DPI,
+        MEMORY_BUDGET,
+        CURVE_TOLERANCE,
+        *(layer_simplification(layer) for layer in TRACED_LAYERS),
+    )
+    digest.update(f"\0{settings}".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def write_item(buf: StringIO, item) -> None:
+    match item:
+        case s.L():
+            buf.write(item.val)
+        case s.S() if item.attributes:
+            item.write(buf, depth=1)
+        case _:
+            buf.write(" ")
+            item.write(buf)
+
+
+def _chunks(text: str, chunk_size: int) -> Iterator[bytes]:
+    for start in range(0, len(text), chunk_size):
+        yield text[start : start + chunk_size].encode("utf-8")
+
+
 class PCB(gingerbread.pcb.PCB):
+    # Raster layers are traced on this executor when set, their items are
+    # placeholders until resolve() is called.
+    executor: Optional[Executor] = None
+    cache: Optional[TraceCache] = None
+    # UUIDs are derived from this and each item when set, instead of random,
+    # so that the same board is always written to the same bytes.
+    seed: Optional[str] = None
+
+    def place(self, items: list) -> None:
+        """Adds the items of a board drawn at the origin, moved to the offset"""
+        self.items += [translate(item, *self.offset) for item in items]
+
+    def add_pending_literal(self, future: Future) -> None:
+        self.items.append(future)
+
+    def resolve(self) -> None:
+        # Layers with nothing to trace resolve to an empty string
+        self.items = [
+            s.L(item.result()) if isinstance(item, Future) else item
+            for item in self.items
+            if not isinstance(item, Future) or item.result()
+        ]
+
+    def iter_write(self, chunk_size: int = 64 * 1024) -> Iterator[bytes]:
+        """
+        Serializes the board like write(), but item by item in UTF-8 chunks of
+        roughly `chunk_size` bytes instead of building the whole file at once.
+        """
+        # The header and footer around the items come from write() itself,
+        # with a single marker item standing in for the board's items. With a
+        # seed the title block is left undated, so the output doesn't change
+        # with the day the worker started.
+        marker = "\0items\0"
+        items, self.items = self.items, [s.L(marker)]
+        try:
+            frame = StringIO()
+            self.write(frame)
+        finally:
+            self.items = items
+        head, tail = frame.getvalue().split(marker)
+        if self.seed is not None:
+            head = TITLE_DATE.sub(DETERMINISTIC_DATE, head, count=1)
+
+        buf = StringIO(head)
+        buf.seek(0, SEEK_END)
+        seen: Counter = Counter()
+        for item in self.items:
+            if self.seed is None:
+                write_item(buf, item)
+            else:
+                item_buf = StringIO()
+                write_item(item_buf, item)
+                buf.write(stable_ids(item_buf.getvalue(), self.seed, seen))
+
+            if buf.tell() >= chunk_size:
+                yield from _chunks(buf.getvalue(), chunk_size)
+                buf = StringIO()
+        buf.write(tail)
+        yield from _chunks(buf.getvalue(), chunk_size)
+
     def add_circle(
         self, x, y, d, *, layer: str, fill: bool = False, width: float = 0.15
     ):
         self.items.append(
             s.gr_circle(
-                center=(x, y),
-                end=(x, y + d / 2),
+                center=(x + self.offset[0], y + self.offset[1]),
+                end=(x + self.offset[0], y + d / 2 + self.offset[1]),
                 layer=layer,
                 width=width,
                 fill=fill,
             )
         )
 
+    def add_arc(self, start, mid, end, *, layer: str, width: float = 0.1):
+        self.items.append(
+            s.gr_arc(
+                start=(start[0] + self.offset[0], start[1] + self.offset[1]),
+                mid=(mid[0] + self.offset[0], mid[1] + self.offset[1]),
+                end=(end[0] + self.offset[0], end[1] + self.offset[1]),
+                layer=layer,
+                width=width,
+            )
+        )
+
     def add_plated_drill(self, x, y, d, pad_size):
         self.items.append(
             s.footprint(
@@ -125,7 +384,10 @@ def inline_symbols(root: etree._Element) -> None:
         symbol = symbols.get(
             use.get(QName(nsmap["xlink"], "href").text).replace("#", "")
         )
-        replacement = etree.Element("g", attrib={"transform": use.get("transform")})
+        replacement = etree.Element(
+            "g",
+            attrib={"transform": use.get("transform"), SYMBOL_ATTR: symbol.get("id")},
+        )
         for child in symbol:
             replacement.append(deepcopy(child))
         use.getparent().replace(use, replacement)
@@ -145,30 +407,19 @@ def recolor_node_children(
 ) -> etree._Element:
     new_node = copy_node(node)
 
-    style = cssutils.parseStyle(node.get("style", ""), validate=False)
-
-    if new_node.get("fill") != "none" and new_node.get("fill") is not None:
-        style["fill"] = new_node.get("fill")
+    fill = new_node.get("fill")
+    if fill == "none":
+        fill = None
+    elif fill is not None:
         del new_node.attrib["fill"]
 
-    fill = style["fill"]
-    if force_fill or (fill != "" and fill is not None and fill != "none"):
-        style["fill"] = "#000"
-
-    if new_node.get("stroke") != "none" and new_node.get("stroke") is not None:
-        style["stroke"] = new_node.get("stroke")
+    stroke = new_node.get("stroke")
+    if stroke == "none":
+        stroke = None
+    elif stroke is not None:
         del new_node.attrib["stroke"]
 
-    stroke = style["stroke"]
-    if stroke != "" and stroke is not None and stroke != "none":
-        style["stroke"] = "#000"
-
-    new_style = (
-        html.unescape(style.getCssText(separator=""))
-        .replace('"', "'")
-        .replace(": ", ":")
-    )
-
+    new_style = recolor_style(node.get("style", ""), fill, stroke, force_fill)
     if new_style != "":
         new_node.set("style", new_style)
 
@@ -178,19 +429,77 @@ def recolor_node_children(
     return new_node
 
 
+# (inkscape label, force fill) of a layer to extract from the document
+LayerKey = tuple[str, bool]
+Layers = dict[LayerKey, Optional[etree._Element]]
+
+CONVERTED_LAYERS: list[LayerKey] = [
+    ("Cuts", False),
+    ("Cuts", True),
+    ("Relief", False),
+    ("Front", False),
+    ("Alignment", False),
+]
+
+
+def _split_node(
+    node: etree._Element, keys: list[LayerKey], label_attr: str, is_root: bool
+) -> Layers:
+    layers: Layers = {}
+
+    label = node.get(label_attr)
+    pending = []
+    for key in keys:
+        layer, fill = key
+        if label == layer and len(node) > 0:
+            layers[key] = recolor_node_children(node, fill)
+        else:
+            pending.append(key)
+
+    if not pending:
+        return layers
+
+    children = [_split_node(child, pending, label_attr, False) for child in node]
+    for key in pending:
+        kept = [child[key] for child in children if child[key] is not None]
+        if not kept:
+            layers[key] = None
+            continue
+
+        if is_root:
+            new_node = etree.Element(node.tag, attrib=node.attrib, nsmap=node.nsmap)
+        else:
+            new_node = etree.Element(node.tag, attrib=node.attrib)
+            new_node.text = node.text
+        new_node.extend(kept)
+        layers[key] = new_node
+
+    return layers
+
+
+def split_layers(node: etree._Element, keys: list[LayerKey]) -> Layers:
+    """
+    Extracts several layers from the document in a single traversal, each
+    layer keeps the ancestors of the matched nodes but nothing else.
+    """
+    nsmap = node.getroottree().getroot().nsmap
+    label_attr = f"{{{nsmap['inkscape']}}}label"
+    is_root = node == node.getroottree().getroot()
+    return _split_node(node, list(dict.fromkeys(keys)), label_attr, is_root)
+
+
 def filter_node(
     node: etree._Element, layer: str, fill: bool = False
 ) -> Optional[etree._Element]:
-    if inkscape_label(node) == layer and len(node) > 0:
-        return recolor_node_children(node, fill)
+    return split_layers(node, [(layer, fill)])[(layer, fill)]
 
-    new_node = copy_node(node)
-    for child in node:
-        filtered_child = filter_node(child, layer, fill)
-        if filtered_child is not None:
-            new_node.append(filtered_child)
 
-    return new_node if len(new_node) > 0 else None
+def layer_root(
+    svg: etree._ElementTree, layers: Optional[Layers], layer: str, fill: bool = False
+) -> Optional[etree._Element]:
+    if layers is None:
+        return filter_node(svg.getroot(), layer, fill)
+    return layers[(layer, fill)]
 
 
 def get_dimensions(svg: etree._ElementTree) -> tuple[float, float]:
@@ -200,10 +509,16 @@ def get_dimensions(svg: etree._ElementTree) -> tuple[float, float]:
     return width, height
 
 
-def add_cuts_layer(pcb: PCB, svg: etree._ElementTree) -> None:
+def add_cuts_layer(
+    pcb: PCB,
+    svg: etree._ElementTree,
+    layers: Optional[Layers] = None,
+    *,
+    tolerance: float = CURVE_TOLERANCE,
+) -> None:
     width, height = get_dimensions(svg)
 
-    filtered_root = filter_node(svg.getroot(), "Cuts")
+    filtered_root = layer_root(svg, layers, "Cuts")
     if filtered_root is None:
         return
 
@@ -217,13 +532,8 @@ def add_cuts_layer(pcb: PCB, svg: etree._ElementTree) -> None:
         fill=False,
     )
 
-    svg = SVG.parse(
-        BytesIO(etree.tostring(etree.ElementTree(filtered_root))),
-        ppi=25.4,
-    )
-
     shape: Circle | Path | Rect
-    for shape in svg.select(lambda el: isinstance(el, (Circle, Path, Rect))):
+    for shape in select_shapes(filtered_root, (Circle, Path, Rect)):
         if isinstance(shape, Rect) and shape.ry is None:
             pcb.add_rect(
                 x=round(shape.x, 5),
@@ -278,21 +588,97 @@ def add_cuts_layer(pcb: PCB, svg: etree._ElementTree) -> None:
                 else:
                     pcb.add_drill(x=shape.cx, y=shape.cy, d=diameter)
         elif isinstance(shape, Path):
-            shape.approximate_arcs_with_cubics()
-            points = []
-            for segment in shape.segments():
-                if isinstance(segment, Line):
-                    points.append((segment.start.x, segment.start.y))
-                    points.append((segment.end.x, segment.end.y))
-                elif isinstance(segment, CubicBezier):
-                    points += bezier_to_points(
-                        (segment.start.x, segment.start.y),
-                        (segment.control1.x, segment.control1.y),
-                        (segment.control2.x, segment.control2.y),
-                        (segment.end.x, segment.end.y),
-                        0.0001,
-                    )
-            pcb.add_poly(points, layer="Edge.Cuts")
+            for outline in path_outlines(shape, tolerance):
+                add_outline(pcb, outline)
+
+
+def add_outline(pcb: PCB, outline: Outline) -> None:
+    if not outline.has_arcs():
+        pcb.add_poly(outline.points(), layer="Edge.Cuts")
+        return
+
+    # Polygons can't hold arcs, so the outline is drawn piece by piece
+    start = outline.start
+    for piece in outline.pieces:
+        if isinstance(piece, ArcTo):
+            pcb.add_arc(start, piece.mid, piece.end, layer="Edge.Cuts")
+            start = piece.end
+        else:
+            pcb.add_line(*start, *piece, layer="Edge.Cuts")
+            start = piece
+    if distance(start, outline.start) >= EPSILON:
+        pcb.add_line(*start, *outline.start, layer="Edge.Cuts")
+
+
+def split_future(future: Future, count: int) -> list[Future]:
+    """One future per item of the tuple `future` resolves to"""
+    parts = [Future() for _ in range(count)]
+
+    def resolve_parts(done: Future) -> None:
+        if done.exception() is not None:
+            for part in parts:
+                part.set_exception(done.exception())
+            return
+        for part, result in zip(parts, done.result()):
+            part.set_result(result)
+
+    future.add_done_callback(resolve_parts)
+    return parts
+
+
+def cached_trace(
+    pcb: PCB,
+    svg_string: bytes,
+    layer: str,
+    *,
+    invert: bool,
+    dpi: int,
+    simplification: Simplification,
+    memory_budget: int = MEMORY_BUDGET,
+    placed: Sequence[Placement] = (),
+) -> tuple[Optional[str], Optional[str]]:
+    """
+    The cache key of a trace and the cached trace, if any. Traces split into
+    tiles by a smaller `memory_budget` are stitched at the seams, which may
+    not give the same vertices as a single render, so it's part of the key.
+    The symbols `placed` with the trace are keyed by their pages and offsets.
+    """
+    if pcb.cache is None:
+        return None, None
+
+    options: tuple = (RASTERIZER.name, memory_budget, *simplification)
+    if placed:
+        digest = hashlib.sha256()
+        for placement in placed:
+            digest.update(placement.document)
+            digest.update(f"\0{placement.x!r}\0{placement.y!r}\0".encode("utf-8"))
+        options += (digest.hexdigest(),)
+
+    key = trace_key(svg_string, layer, invert=invert, dpi=dpi, options=options)
+    return key, pcb.cache.get(key)
+
+
+def add_trace(pcb: PCB, layer: str, key: Optional[str], traced: str | Future) -> None:
+    """Adds a traced layer, which may still be pending, and caches it at `key`"""
+
+    def record_trace(result: str) -> None:
+        count_trace(layer, result)
+        if key is not None:
+            pcb.cache.put(key, result)
+
+    if isinstance(traced, Future):
+
+        def record_done(done: Future) -> None:
+            if done.exception() is None:
+                record_trace(done.result())
+
+        traced.add_done_callback(record_done)
+        pcb.add_pending_literal(traced)
+        return
+
+    record_trace(traced)
+    if traced:
+        pcb.add_literal(traced)
 
 
 def raster_svg(
@@ -301,35 +687,70 @@ def raster_svg(
     layer: str,
     *,
     invert: bool = False,
-    dpi: int = 2540,
+    dpi: int = DPI,
+    memory_budget: int = MEMORY_BUDGET,
+    simplification: Optional[Simplification] = None,
+    regions: Optional[list[Region]] = None,
+    placed: Sequence[Placement] = (),
 ) -> None:
-    tree = cairosvg.parser.Tree(bytestring=etree.tostring(svg))
+    """
+    Traces `svg` onto `layer` with the `placed` symbols, the parts of the page
+    drawn on or only `regions` of it. Traces are cached by the document and
+    symbols alone, as the regions cover everything it draws whichever way
+    they're cut.
+    """
+    svg_string = etree.tostring(svg)
+    if simplification is None:
+        simplification = layer_simplification(layer)
+
+    key, traced = cached_trace(
+        pcb,
+        svg_string,
+        layer,
+        invert=invert,
+        dpi=dpi,
+        simplification=simplification,
+        memory_budget=memory_budget,
+        placed=placed,
+    )
+    if traced is not None:
+        add_trace(pcb, layer, None, traced)
+        return
 
-    surface = cairosvg.surface.PNGSurface(
-        tree,
-        output=None,
-        background_color="#fff",
+    options = dict(
+        invert=invert,
         dpi=dpi,
-        map_rgba=cairosvg.colors.negate_color if invert else lambda x: x,
+        memory_budget=memory_budget,
+        simplification=simplification,
+        placed=placed,
     )
-    surface.cairo.flush()
-    # surface.cairo.write_to_png(f'{layer}.png')
-
-    pcb.add_literal(
-        trace(
-            surface.cairo,
-            layer=layer,
-            dpi=dpi,
-            center=False,
+    if pcb.executor is not None and regions is not None:
+        traced = pcb.executor.submit(
+            trace_regions_string, svg_string, regions, layer, **options
         )
-    )
+    elif pcb.executor is not None:
+        traced = pcb.executor.submit(trace_svg_string, svg_string, layer, **options)
+    elif regions is not None:
+        traced = trace_regions(svg, regions, layer, **options)
+    else:
+        traced = trace_svg(svg, layer, **options)
+    add_trace(pcb, layer, key, traced)
 
 
-def add_copper_layers(pcb: PCB, svg: etree._ElementTree) -> None:
+def add_copper_layers(
+    pcb: PCB, svg: etree._ElementTree, layers: Optional[Layers] = None
+) -> None:
     width, height = get_dimensions(svg)
 
-    holes_root = filter_node(svg.getroot(), "Cuts", fill=True)
-    relief_root = filter_node(svg.getroot(), "Relief")
+    holes_root = layer_root(svg, layers, "Cuts", fill=True)
+    relief_root = layer_root(svg, layers, "Relief")
+
+    # Symbols are traced once each and cut out of the copper where they're
+    # placed, only what's left of the layers is rendered.
+    holes_placed = place_instances(holes_root, DPI)
+    stacked_placed = holes_placed
+    if relief_root is not None:
+        stacked_placed = holes_placed + place_instances(relief_root, DPI)
 
     background = etree.Element(
         "rect",
@@ -342,23 +763,275 @@ def add_copper_layers(pcb: PCB, svg: etree._ElementTree) -> None:
         },
     )
     holes_root.insert(0, background)
-    raster_svg(pcb, etree.ElementTree(holes_root), "B.Cu", invert=True)
+    holes = etree.ElementTree(holes_root)
+    relief = None if relief_root is None else etree.ElementTree(relief_root)
+
+    # F.Cu is cached under the holes with the relief moved in, the relief is
+    # only moved there to serialize that document.
+    holes_string = etree.tostring(holes)
+    relief_string = None if relief is None else etree.tostring(relief)
+    count = len(holes_root)
+    if relief_root is not None:
+        holes_root.extend(list(relief_root))
+    stacked_string = etree.tostring(holes)
+    if relief_root is not None:
+        relief_root.extend(holes_root[count:])
+
+    simplifications = (layer_simplification("B.Cu"), layer_simplification("F.Cu"))
+    back_key, back = cached_trace(
+        pcb,
+        holes_string,
+        "B.Cu",
+        invert=True,
+        dpi=DPI,
+        simplification=simplifications[0],
+        placed=holes_placed,
+    )
+    front_key, front = cached_trace(
+        pcb,
+        stacked_string,
+        "F.Cu",
+        invert=True,
+        dpi=DPI,
+        simplification=simplifications[1],
+        placed=stacked_placed,
+    )
+    if back is not None and front is not None:
+        add_trace(pcb, "B.Cu", None, back)
+        add_trace(pcb, "F.Cu", None, front)
+        return
 
-    for child in relief_root:
-        holes_root.append(child)
+    if pcb.executor is not None:
+        # One job rather than one per layer: F.Cu reuses the B.Cu render, which
+        # costs more CPU and memory than the copper takes to trace in parallel.
+        back, front = split_future(
+            pcb.executor.submit(
+                trace_stacked_string,
+                holes_string,
+                relief_string,
+                ("B.Cu", "F.Cu"),
+                invert=True,
+                dpi=DPI,
+                simplifications=simplifications,
+                placed=(holes_placed, stacked_placed),
+            ),
+            2,
+        )
+    else:
+        back, front = trace_stacked(
+            holes,
+            relief,
+            ("B.Cu", "F.Cu"),
+            invert=True,
+            dpi=DPI,
+            simplifications=simplifications,
+            placed=(holes_placed, stacked_placed),
+        )
+    add_trace(pcb, "B.Cu", back_key, back)
+    add_trace(pcb, "F.Cu", front_key, front)
 
-    raster_svg(pcb, etree.ElementTree(holes_root), "F.Cu", invert=True)
 
+def layer_objects(node: etree._Element, label: str) -> Iterator[etree._Element]:
+    """The top-level objects of the layers labelled `label` within `node`"""
+    if inkscape_label(node) != label:
+        for child in node:
+            yield from layer_objects(child, label)
+        return
+
+    # Layers holding a single group are split into the group's objects
+    while len(node) == 1 and QName(node[0]).localname == "g":
+        node = node[0]
 
-def add_front_layer(pcb: PCB, svg: etree._ElementTree) -> None:
-    front_root = filter_node(svg.getroot(), "Front")
-    raster_svg(pcb, etree.ElementTree(front_root), "F.SilkS")
+    for child in node:
+        if not isinstance(child.tag, str):
+            continue
+        name = QName(child).localname
+        if name == "defs" or (name == "g" and len(child) == 0):
+            continue
+        yield child
 
 
-def add_alignment_footprints(pcb: PCB, svg: etree._ElementTree) -> None:
+def _keep_objects(
+    node: etree._Element, objects: set[etree._Element], ancestors: set[etree._Element]
+) -> etree._Element:
+    new_node = copy_node(node)
+    for child in node:
+        if child in objects or (
+            isinstance(child.tag, str) and QName(child).localname == "defs"
+        ):
+            new_node.append(deepcopy(child))
+        elif child in ancestors:
+            new_node.append(_keep_objects(child, objects, ancestors))
+    return new_node
+
+
+def objects_document(
+    root: etree._Element, objects: list[etree._Element]
+) -> etree._ElementTree:
+    """
+    A copy of the document `root` drawing only `objects`, with their ancestors
+    (and so their transforms) and the definitions along the way
+    """
+    ancestors = {ancestor for item in objects for ancestor in item.iterancestors()}
+    return etree.ElementTree(_keep_objects(root, set(objects), ancestors))
+
+
+def object_box(
+    document: etree._ElementTree,
+) -> Optional[tuple[float, float, float, float]]:
+    """
+    Bounds (in mm) of what `document` draws, or None unless they're exact.
+    Glyphs, strokes, markers and filters would only be estimated, and images
+    without a size have no bounds to speak of.
+    """
+    parsed = SVG.parse(BytesIO(etree.tostring(document)), ppi=MM_PER_INCH)
+    boxes = []
+    for element in parsed.elements():
+        if isinstance(element, Text) or any(
+            element.values.get(name, "none") != "none"
+            for name in UNMEASURED_ATTRIBUTES
+        ):
+            return None
+        if isinstance(element, Shape):
+            if element.stroke is not None and element.stroke.value is not None:
+                return None
+            box = element.bbox()
+            if box is not None:
+                boxes.append(box)
+        elif isinstance(element, Image):
+            box = element.bbox()
+            if box is None or box[0] >= box[2] or box[1] >= box[3]:
+                return None
+            boxes.append(box)
+
+    if not boxes:
+        return None
+    lefts, tops, rights, bottoms = zip(*boxes)
+    return min(lefts), min(tops), max(rights), max(bottoms)
+
+
+def island_owners(count: int, touched: list[list[int]]) -> list[int]:
+    """
+    The island each of `count` islands is grouped under, islands are joined
+    through the objects that may draw on several of them, the indices of the
+    islands each object may draw on are `touched`.
+    """
+    owners = list(range(count))
+
+    def owner(index: int) -> int:
+        while owners[index] != index:
+            owners[index] = owners[owners[index]]
+            index = owners[index]
+        return index
+
+    for hits in touched:
+        for index in hits[1:]:
+            owners[owner(index)] = owner(hits[0])
+    return [owner(index) for index in range(count)]
+
+
+def front_batches(
+    root: etree._Element, islands: list[Region]
+) -> list[tuple[list[etree._Element], list[Region]]]:
+    """
+    Groups the objects of the Front layer in `root` with the `islands` of the
+    page they may draw on. Objects that may draw on the same island are traced
+    together, and so are neighbouring groups until they cover FRONT_BATCH_AREA.
+    The whole layer is a single batch unless the bounds of every object are
+    known exactly, an object drawing past its estimated box would otherwise be
+    cut off where it reaches the island of another batch.
+    """
+    objects = list(layer_objects(root, "Front"))
+    px_per_mm = DPI / MM_PER_INCH
+
+    touched = []
+    for item in objects:
+        box = object_box(objects_document(root, [item]))
+        if box is None:
+            return [(objects, islands)]
+
+        left, top, right, bottom = (value * px_per_mm for value in box)
+        hits = [
+            index
+            for index, island in enumerate(islands)
+            if island.left < right
+            and left < island.right
+            and island.top < bottom
+            and top < island.bottom
+        ]
+        touched.append(hits)
+
+    owners = island_owners(len(islands), touched)
+    groups: dict[int, tuple[list[etree._Element], list[Region]]] = {}
+    for index, island in enumerate(islands):
+        groups.setdefault(owners[index], ([], []))[1].append(island)
+    for item, hits in zip(objects, touched):
+        if hits:
+            groups[owners[hits[0]]][0].append(item)
+
+    if any(not group_objects for group_objects, _ in groups.values()):
+        # Something draws where no object was expected, trace it all at once
+        return [(objects, islands)]
+
+    batches: list[tuple[list[etree._Element], list[Region]]] = []
+    area = 0.0
+    for group_objects, regions in sorted(
+        groups.values(), key=lambda group: min(region.top for region in group[1])
+    ):
+        if batches and area < FRONT_BATCH_AREA * px_per_mm**2:
+            batches[-1][0].extend(group_objects)
+            batches[-1][1].extend(regions)
+        else:
+            batches.append((list(group_objects), list(regions)))
+            area = 0.0
+        area += sum(
+            (region.right - region.left) * (region.bottom - region.top)
+            for region in regions
+        )
+
+    return batches
+
+
+def add_front_layer(
+    pcb: PCB, svg: etree._ElementTree, layers: Optional[Layers] = None
+) -> None:
+    front_root = layer_root(svg, layers, "Front")
+    if front_root is None:
+        return
+
+    # Symbols are traced once each and placed apart from the rest of the
+    # layer, which is previewed once, then traced and cached in batches of
+    # objects, rendered only over the parts of the page they draw on. An edit
+    # only retraces the batch it falls in.
+    placed = place_instances(front_root, DPI)
+    if placed:
+        raster_svg(
+            pcb,
+            objects_document(front_root, []),
+            "F.SilkS",
+            regions=[],
+            placed=placed,
+        )
+
+    islands = content_regions(
+        etree.ElementTree(front_root),
+        invert=False,
+        dpi=DPI,
+        gap=OBJECT_GAP,
+        split_columns=True,
+    )
+    for objects, regions in front_batches(front_root, islands):
+        raster_svg(
+            pcb, objects_document(front_root, objects), "F.SilkS", regions=regions
+        )
+
+
+def add_alignment_footprints(
+    pcb: PCB, svg: etree._ElementTree, layers: Optional[Layers] = None
+) -> None:
     max_height = 110
     width, height = get_dimensions(svg)
-    filtered_root = filter_node(svg.getroot(), "Alignment")
+    filtered_root = layer_root(svg, layers, "Alignment")
     if filtered_root is None:
         return
 
@@ -371,9 +1044,8 @@ def add_alignment_footprints(pcb: PCB, svg: etree._ElementTree) -> None:
         layer="Dwgs.User",
     )
 
-    svg = SVG.parse(BytesIO(etree.tostring(etree.ElementTree(filtered_root))), ppi=25.4)
     shape: Circle
-    for shape in svg.select(lambda el: isinstance(el, Circle)):
+    for shape in select_shapes(filtered_root, (Circle,)):
         pcb.add_circle(
             shape.cx,
             shape.cy,
@@ -382,17 +1054,65 @@ def add_alignment_footprints(pcb: PCB, svg: etree._ElementTree) -> None:
         )
 
 
-def convert(stream: BytesIO, name: str) -> BytesIO:
-    svg = etree.parse(stream)
-    inline_symbols(svg.getroot())
+STAGES = {
+    "cuts": add_cuts_layer,
+    "front": add_front_layer,
+    "copper": add_copper_layers,
+    "alignment": add_alignment_footprints,
+}
+
+
+def convert_panel(
+    stream: BytesIO,
+    name: str,
+    executor: Optional[Executor] = None,
+    cache: Optional[TraceCache] = None,
+    progress: Optional[Callable[[str], None]] = None,
+    deterministic: bool = False,
+) -> PCB:
+    """
+    Converts the panel read from `stream`, when `deterministic` the same panel
+    is always written to the same bytes.
+    """
+    seed = None
+    if deterministic:
+        content = stream.read()
+        seed = hashlib.sha256(content).hexdigest()
+        stream = BytesIO(content)
+
+    with timed("parse"):
+        svg = etree.parse(stream)
+    with timed("inline_symbols"):
+        inline_symbols(svg.getroot())
 
     panel = PCB(title=name, company="mlon")
-
-    add_cuts_layer(panel, svg)
-    add_front_layer(panel, svg)
-    add_copper_layers(panel, svg)
-    add_alignment_footprints(panel, svg)
-
-    buf = StringIO()
-    panel.write(buf)
-    return BytesIO(buf.getvalue().encode("utf-8"))
+    panel.executor = executor
+    panel.cache = cache
+    panel.seed = seed
+
+    with timed("split_layers"):
+        layers = split_layers(svg.getroot(), CONVERTED_LAYERS)
+    for stage, add_layer in STAGES.items():
+        if progress is not None:
+            progress(stage)
+        with timed(stage):
+            add_layer(panel, svg, layers)
+    with timed("resolve"):
+        panel.resolve()
+
+    return panel
+
+
+def convert(
+    stream: BytesIO,
+    name: str,
+    executor: Optional[Executor] = None,
+    cache: Optional[TraceCache] = None,
+    deterministic: bool = False,
+) -> BytesIO:
+    buf = BytesIO()
+    panel = convert_panel(stream, name, executor, cache, deterministic=deterministic)
+    for chunk in panel.iter_write():
+        buf.write(chunk)
+    buf.seek(0)
+    return buf
@@ -0,0 +1,142 @@
+"""
+Predicts the memory and time a conversion needs from the document alone
+"""
+import base64
+import re
+import struct
+from io import BytesIO
+from typing import NamedTuple
+
+from lxml import etree
+
+from .admission import Unreadable
+from .page import BYTES_PER_PIXEL, DPI, MEMORY_BUDGET, MM_PER_INCH, page_size
+
+# Coefficients of the model, compare the predicted and actual costs logged by
+# the admission scheduler to tune them.
+BASE_MEMORY = 64 * 1024 * 1024
+# lxml and svgelements memory per element of the document
+BYTES_PER_NODE = 2048
+# Bytes per pixel of a rendered tile alive at once: the ARGB surface and the
+# one byte per pixel bitmaps thresholded from it, the base and the stacked one.
+# The surface is freed before potrace makes its own, packed, copy.
+RENDER_BYTES_PER_PIXEL = BYTES_PER_PIXEL + 2
+# Raster layers rendered (Front and the holes) and traced (B.Cu, F.Cu, Front)
+RENDERED_LAYERS = 2
+TRACED_LAYERS = 3
+SECONDS_PER_MEGAPIXEL = 0.02
+SECONDS_PER_SEGMENT = 2e-5
+# Outline segments drawn for a character of text
+SEGMENTS_PER_GLYPH = 24
+# Decoded pixels assumed per byte of an embedded image that isn't a PNG
+PIXELS_PER_IMAGE_BYTE = 8
+
+PATH_COMMAND = re.compile(r"[MLHVCSQTAZmlhvcsqtaz]")
+NUMBER = re.compile(r"[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?")
+DATA_URI = re.compile(r"data:image/[^;,]+;base64,", re.IGNORECASE)
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+
+class Estimate(NamedTuple):
+    # page size in mm
+    width: float
+    height: float
+    nodes: int
+    # path segments, polygon points and text glyphs
+    segments: int
+    # pixels of embedded images once decoded
+    image_pixels: int
+    # predicted peak memory in bytes, and wall time in seconds
+    memory: int
+    seconds: float
+
+
+def image_pixels(href: str) -> int:
+    """Decoded size of an embedded image, read from its header when it's a PNG"""
+    match = DATA_URI.match(href)
+    if match is None:
+        return 0
+
+    data = href[match.end() :]
+    try:
+        # signature and IHDR chunk
+        header = base64.b64decode(data[:44] + "=" * (-len(data[:44]) % 4))
+    except ValueError:
+        header = b""
+
+    if header.startswith(PNG_SIGNATURE) and len(header) >= 24:
+        width, height = struct.unpack(">II", header[16:24])
+        return width * height
+    return len(data) * 3 // 4 * PIXELS_PER_IMAGE_BYTE
+
+
+def element_segments(element: etree._Element) -> int:
+    match etree.QName(element).localname:
+        case "path":
+            return len(PATH_COMMAND.findall(element.get("d", "")))
+        case "polygon" | "polyline":
+            return len(NUMBER.findall(element.get("points", ""))) // 2
+        case "text" | "tspan":
+            return len((element.text or "").strip()) * SEGMENTS_PER_GLYPH
+        case _:
+            return 1
+
+
+def estimate(
+    svg: bytes, *, dpi: float = DPI, memory_budget: int = MEMORY_BUDGET
+) -> Estimate:
+    """
+    Reads `svg` once, without building the document, and predicts the peak
+    memory and wall time of converting it. Raises Unreadable for documents
+    the conversion couldn't parse either, including those past libxml2's
+    limits on depth and size.
+    """
+    root = None
+    nodes = segments = pixels = 0
+    try:
+        for event, element in etree.iterparse(BytesIO(svg), events=("start", "end")):
+            if event == "start":
+                if root is None:
+                    root = element
+                continue
+
+            nodes += 1
+            segments += element_segments(element)
+            for name, value in element.attrib.items():
+                if name.endswith("href"):
+                    pixels += image_pixels(value)
+
+            # Only the root's attributes are needed past this point
+            if element is not root:
+                element.clear(keep_tail=False)
+                while element.getprevious() is not None:
+                    del element.getparent()[0]
+    except etree.XMLSyntaxError as error:
+        raise Unreadable(f"The SVG can't be read: {error}") from error
+
+    width, height = page_size(root)
+    page_pixels = width * height * (dpi / MM_PER_INCH) ** 2
+    render_memory = (
+        min(page_pixels, memory_budget / BYTES_PER_PIXEL) * RENDER_BYTES_PER_PIXEL
+    )
+
+    memory = (
+        BASE_MEMORY
+        + len(svg) * 2
+        + nodes * BYTES_PER_NODE
+        + pixels * BYTES_PER_PIXEL
+        + render_memory
+    )
+    seconds = (
+        RENDERED_LAYERS + TRACED_LAYERS
+    ) * page_pixels / 1e6 * SECONDS_PER_MEGAPIXEL + segments * SECONDS_PER_SEGMENT
+
+    return Estimate(
+        width=width,
+        height=height,
+        nodes=nodes,
+        segments=segments,
+        image_pixels=pixels,
+        memory=int(memory),
+        seconds=seconds,
+    )
@@ -1,11 +1,17 @@
+import functools
+import hashlib
 import os
 import os.path
+import threading
+from copy import deepcopy
 from io import BytesIO
-from typing import NamedTuple
+from typing import NamedTuple, Optional
 
 from lxml import etree
 from lxml.etree import Element, ElementTree, QName, SubElement, _Element
 
+from .metrics import timed
+
 HP_TO_MM = {
     2: 9.8,
     3: 15,
@@ -244,23 +250,67 @@ def add_relief(parent: _Element, width: float, height: float) -> None:
     )
 
 
-def add_symbols(parent: _Element) -> None:
-    symbol_dir = os.path.join(os.path.dirname(__file__), "..", "symbols")
+class SymbolLibrary:
+    """
+    Symbols parsed once from `directory` and copied into each document, with
+    `watch` set the directory is rescanned whenever a file is added, removed or
+    modified.
+    """
+
+    def __init__(self, directory: str, watch: bool = False):
+        self.directory = directory
+        self.watch = watch
+        self.lock = threading.Lock()
+        self.signature: Optional[tuple[tuple[str, int], ...]] = None
+        self.templates: list[_Element] = []
+
+    def scan(self) -> tuple[tuple[str, int], ...]:
+        return tuple(
+            (entry.name, entry.stat().st_mtime_ns)
+            for entry in sorted(os.scandir(self.directory), key=lambda e: e.name)
+            if entry.name.endswith(".svg")
+        )
+
+    def load(self, signature: tuple[tuple[str, int], ...]) -> list[_Element]:
+        templates = []
+        for symbol_file, _ in signature:
+            symbol_name = os.path.splitext(symbol_file)[0].replace(" ", "_").lower()
+            symbol_svg = etree.parse(os.path.join(self.directory, symbol_file))
+
+            symbol = Element("symbol", attrib={"id": symbol_name})
+            SubElement(symbol, "title").text = os.path.splitext(symbol_file)[0]
+            for element in symbol_svg.getroot():
+                if (
+                    element.tag == QName(NS.svg, "g")
+                    and element.get(inkscape("groupmode")) == "layer"
+                ):
+                    symbol.append(element)
+            templates.append(symbol)
+        return templates
+
+    def symbols(self) -> list[_Element]:
+        if self.signature is not None and not self.watch:
+            return self.templates
+
+        with self.lock:
+            signature = self.scan()
+            if signature != self.signature:
+                self.templates = self.load(signature)
+                self.signature = signature
+            return self.templates
+
+    def version(self) -> tuple[tuple[str, int], ...]:
+        """Signature of the current symbols, changes whenever they are reloaded"""
+        self.symbols()
+        return self.signature
 
-    for symbol_file in os.listdir(symbol_dir):
-        if not symbol_file.endswith(".svg"):
-            continue
-        symbol_name = os.path.splitext(symbol_file)[0].replace(" ", "_").lower()
-        symbol_svg = etree.parse(os.path.join(symbol_dir, symbol_file))
 
-        symbol = SubElement(parent, "symbol", attrib={"id": symbol_name})
-        SubElement(symbol, "title").text = os.path.splitext(symbol_file)[0]
-        for element in symbol_svg.getroot():
-            if (
-                element.tag == QName(NS.svg, "g")
-                and element.get(inkscape("groupmode")) == "layer"
-            ):
-                symbol.append(element)
+SYMBOLS = SymbolLibrary(os.path.join(os.path.dirname(__file__), "..", "symbols"))
+
+
+def add_symbols(parent: _Element) -> None:
+    for symbol in SYMBOLS.symbols():
+        parent.append(deepcopy(symbol))
 
 
 def add_font(parent: _Element) -> None:
@@ -268,7 +318,7 @@ def add_font(parent: _Element) -> None:
     style.text = "@import url('https://fonts.googleapis.com/css?family=Jost:600');"
 
 
-def create(hp: float, name: str = "Untitled Module") -> BytesIO:
+def build(hp: float, name: str) -> ElementTree:
     height = 128.5
     width = HP_TO_MM[hp]
 
@@ -291,7 +341,8 @@ def create(hp: float, name: str = "Untitled Module") -> BytesIO:
     defs = SubElement(root, "defs")
 
     add_font(defs)
-    add_symbols(defs)
+    with timed("create_symbols"):
+        add_symbols(defs)
 
     add_background(root, width, height)
 
@@ -322,4 +373,50 @@ def create(hp: float, name: str = "Untitled Module") -> BytesIO:
     components = add_layer(root, "Components")
     add_mounting_holes(components, width, height)
 
-    return BytesIO(etree.tostring(ElementTree(root), pretty_print=True))
+    return ElementTree(root)
+
+
+# Stands in for the module name in skeletons, which are split around it
+NAME_PLACEHOLDER = "@@panelizer-module-name@@"
+
+
+class Document(NamedTuple):
+    content: bytes
+    etag: str
+
+
+def escape_text(text: str) -> bytes:
+    """Escapes `text` the way lxml serializes a text node"""
+    element = Element("text")
+    element.text = text
+    return etree.tostring(element)[len(b"<text>") : -len(b"</text>")] if text else b""
+
+
+@functools.lru_cache(maxsize=64)
+def skeleton(hp: float, signature: tuple[tuple[str, int], ...]) -> tuple[bytes, ...]:
+    """Serialized panel of `hp`, split around its module name"""
+    with timed("create_serialize"):
+        document = etree.tostring(build(hp, NAME_PLACEHOLDER), pretty_print=True)
+    return tuple(document.split(NAME_PLACEHOLDER.encode("ascii")))
+
+
+@functools.lru_cache(maxsize=1024)
+def panel_document(
+    hp: float, name: str, signature: tuple[tuple[str, int], ...]
+) -> Document:
+    content = escape_text(name).join(skeleton(hp, signature))
+    return Document(content, hashlib.sha256(content).hexdigest())
+
+
+def create_document(hp: float, name: str = "Untitled Module") -> Document:
+    return panel_document(hp, name, SYMBOLS.version())
+
+
+def precompute() -> None:
+    signature = SYMBOLS.version()
+    for hp in HP_TO_MM:
+        skeleton(hp, signature)
+
+
+def create(hp: float, name: str = "Untitled Module") -> BytesIO:
+    return BytesIO(create_document(hp, name).content)
@@ -0,0 +1,299 @@
+"""
+Flattens SVG paths into the polygons, lines and arcs KiCad draws outlines with
+"""
+import math
+import os
+from typing import NamedTuple, Optional, Union
+
+import numpy as np
+from svgelements import (
+    Arc,
+    Close,
+    CubicBezier,
+    Move,
+    Path,
+    PathSegment,
+    QuadraticBezier,
+)
+
+Point = tuple[float, float]
+
+# Maximum distance (in mm) between a curve and the segments approximating it
+CURVE_TOLERANCE = float(os.environ.get("PANELIZER_CURVE_TOLERANCE", 0.005))
+
+# Points closer than this (in mm) are considered the same point, and a point
+# this close to the line through its neighbours is dropped.
+EPSILON = 1e-6
+
+# Curves are split until they are no longer than this recursion depth
+MAX_DEPTH = 16
+
+# Curves that match circles larger than this (in mm) are flattened instead,
+# KiCad can't draw arcs centered that far away.
+MAX_ARC_RADIUS = 1000
+
+
+class ArcTo(NamedTuple):
+    """Circular arc from the previous point of an outline through `mid`"""
+
+    mid: Point
+    end: Point
+
+
+class Outline(NamedTuple):
+    start: Point
+    pieces: list[Union[Point, ArcTo]]
+    closed: bool
+
+    def has_arcs(self) -> bool:
+        return any(isinstance(piece, ArcTo) for piece in self.pieces)
+
+    def points(self) -> list[Point]:
+        return [self.start, *self.pieces]
+
+
+def distance(a: Point, b: Point) -> float:
+    return math.hypot(a[0] - b[0], a[1] - b[1])
+
+
+def line_distance(p: Point, a: Point, b: Point) -> float:
+    length = distance(a, b)
+    if length < EPSILON:
+        return distance(p, a)
+    return abs((b[0] - a[0]) * (a[1] - p[1]) - (a[0] - p[0]) * (b[1] - a[1])) / length
+
+
+def cubic_point(p0: Point, p1: Point, p2: Point, p3: Point, t: float) -> Point:
+    u = 1 - t
+    return (
+        u**3 * p0[0] + 3 * u**2 * t * p1[0] + 3 * u * t**2 * p2[0] + t**3 * p3[0],
+        u**3 * p0[1] + 3 * u**2 * t * p1[1] + 3 * u * t**2 * p2[1] + t**3 * p3[1],
+    )
+
+
+def flatten_cubic(
+    p0: Point, p1: Point, p2: Point, p3: Point, tolerance: float, depth: int = 0
+) -> list[Point]:
+    """
+    Approximates a cubic bezier with line segments no further than `tolerance`
+    from the curve, returns the points after `p0`.
+    """
+    # The curve lies within the hull of its control points, so it is flat
+    # enough once both control points are within tolerance of the chord.
+    if depth >= MAX_DEPTH or (
+        line_distance(p1, p0, p3) <= tolerance
+        and line_distance(p2, p0, p3) <= tolerance
+    ):
+        return [p3]
+
+    # de Casteljau split at t = 0.5
+    p01 = ((p0[0] + p1[0]) / 2, (p0[1] + p1[1]) / 2)
+    p12 = ((p1[0] + p2[0]) / 2, (p1[1] + p2[1]) / 2)
+    p23 = ((p2[0] + p3[0]) / 2, (p2[1] + p3[1]) / 2)
+    p012 = ((p01[0] + p12[0]) / 2, (p01[1] + p12[1]) / 2)
+    p123 = ((p12[0] + p23[0]) / 2, (p12[1] + p23[1]) / 2)
+    mid = ((p012[0] + p123[0]) / 2, (p012[1] + p123[1]) / 2)
+
+    return flatten_cubic(p0, p01, p012, mid, tolerance, depth + 1) + flatten_cubic(
+        mid, p123, p23, p3, tolerance, depth + 1
+    )
+
+
+def circle_through(a: Point, b: Point, c: Point) -> Optional[tuple[Point, float]]:
+    d = 2 * (a[0] * (b[1] - c[1]) + b[0] * (c[1] - a[1]) + c[0] * (a[1] - b[1]))
+    if abs(d) < EPSILON:
+        return None
+
+    a2, b2, c2 = a[0] ** 2 + a[1] ** 2, b[0] ** 2 + b[1] ** 2, c[0] ** 2 + c[1] ** 2
+    center = (
+        (a2 * (b[1] - c[1]) + b2 * (c[1] - a[1]) + c2 * (a[1] - b[1])) / d,
+        (a2 * (c[0] - b[0]) + b2 * (a[0] - c[0]) + c2 * (b[0] - a[0])) / d,
+    )
+    return center, distance(center, a)
+
+
+def cubic_arc(
+    p0: Point, p1: Point, p2: Point, p3: Point, tolerance: float
+) -> Optional[ArcTo]:
+    """Returns the circular arc `p0..p3` traces within `tolerance`, if any"""
+    mid = cubic_point(p0, p1, p2, p3, 0.5)
+    circle = circle_through(p0, mid, p3)
+    if circle is None:
+        return None
+
+    center, radius = circle
+    # Nearly straight curves fit huge circles, they're drawn as lines instead
+    if radius > MAX_ARC_RADIUS or line_distance(mid, p0, p3) <= tolerance:
+        return None
+
+    for t in (0.125, 0.25, 0.375, 0.625, 0.75, 0.875):
+        if abs(distance(cubic_point(p0, p1, p2, p3, t), center) - radius) > tolerance:
+            return None
+
+    return ArcTo(mid, p3)
+
+
+def as_cubic(segment: PathSegment) -> tuple[Point, Point, Point, Point]:
+    start, end = (segment.start.x, segment.start.y), (segment.end.x, segment.end.y)
+    if isinstance(segment, QuadraticBezier):
+        control = (segment.control.x, segment.control.y)
+        return (
+            start,
+            (
+                start[0] + 2 * (control[0] - start[0]) / 3,
+                start[1] + 2 * (control[1] - start[1]) / 3,
+            ),
+            (
+                end[0] + 2 * (control[0] - end[0]) / 3,
+                end[1] + 2 * (control[1] - end[1]) / 3,
+            ),
+            end,
+        )
+
+    return (
+        start,
+        (segment.control1.x, segment.control1.y),
+        (segment.control2.x, segment.control2.y),
+        end,
+    )
+
+
+def segment_pieces(segment: PathSegment, tolerance: float) -> list[Union[Point, ArcTo]]:
+    end = (segment.end.x, segment.end.y)
+
+    if isinstance(segment, Arc):
+        if segment.rx <= MAX_ARC_RADIUS and math.isclose(
+            segment.rx, segment.ry, rel_tol=1e-6
+        ):
+            mid = segment.point(0.5)
+            return [ArcTo((float(mid.x), float(mid.y)), end)]
+
+        pieces: list[Union[Point, ArcTo]] = []
+        for cubic in segment.as_cubic_curves():
+            pieces += flatten_cubic(*as_cubic(cubic), tolerance)
+        return pieces
+
+    if isinstance(segment, (CubicBezier, QuadraticBezier)):
+        p0, p1, p2, p3 = cubic = as_cubic(segment)
+        if (
+            line_distance(p1, p0, p3) <= tolerance
+            and line_distance(p2, p0, p3) <= tolerance
+        ):
+            return [p3]
+
+        arc = cubic_arc(*cubic, tolerance)
+        if arc is not None:
+            return [arc]
+        return flatten_cubic(*cubic, tolerance)
+
+    return [end]
+
+
+def simplify(
+    start: Point, pieces: list[Union[Point, ArcTo]], closed: bool
+) -> list[Union[Point, ArcTo]]:
+    """Drops duplicate points and points on the line through their neighbours"""
+    simplified: list[Union[Point, ArcTo]] = []
+    previous = start
+    for piece in pieces:
+        end = piece.end if isinstance(piece, ArcTo) else piece
+        if distance(previous, end) < EPSILON:
+            continue
+
+        if (
+            not isinstance(piece, ArcTo)
+            and simplified
+            and not isinstance(simplified[-1], ArcTo)
+        ):
+            before = simplified[-2] if len(simplified) > 1 else start
+            if isinstance(before, ArcTo):
+                before = before.end
+            middle = simplified[-1]
+            if (
+                line_distance(middle, before, end) < EPSILON
+                and distance(before, middle) < distance(before, end)
+                and distance(middle, end) < distance(before, end)
+            ):
+                simplified.pop()
+
+        simplified.append(piece)
+        previous = end
+
+    # The closing edge back to the start is implicit
+    if closed and simplified and not isinstance(simplified[-1], ArcTo):
+        if distance(simplified[-1], start) < EPSILON:
+            simplified.pop()
+
+    return simplified
+
+
+def douglas_peucker(points: np.ndarray, tolerance: float) -> np.ndarray:
+    """
+    Drops the vertices of the closed outline `points` that are within
+    `tolerance` of the outline through the remaining ones.
+    """
+    count = len(points)
+    if count < 4:
+        return points
+
+    # The ring is split at the vertex furthest from the first one, each half is
+    # then simplified as an open polyline.
+    ring = np.vstack([points, points[:1]])
+    furthest = int(np.argmax(((points - points[0]) ** 2).sum(axis=1)))
+    keep = np.zeros(count, dtype=bool)
+    keep[0] = keep[furthest] = True
+
+    stack = [(0, furthest), (furthest, count)]
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+
+        a, b = ring[start], ring[end]
+        between = ring[start + 1 : end]
+        chord = b - a
+        length = math.hypot(chord[0], chord[1])
+        if length < EPSILON:
+            distances = np.hypot(between[:, 0] - a[0], between[:, 1] - a[1])
+        else:
+            distances = (
+                np.abs(
+                    chord[0] * (between[:, 1] - a[1])
+                    - chord[1] * (between[:, 0] - a[0])
+                )
+                / length
+            )
+
+        index = int(np.argmax(distances))
+        if distances[index] > tolerance:
+            index += start + 1
+            keep[index] = True
+            stack += [(start, index), (index, end)]
+
+    return points[keep]
+
+
+def path_outlines(path: Path, tolerance: float) -> list[Outline]:
+    """Splits `path` into one outline per subpath"""
+    outlines = []
+    start: Optional[Point] = None
+    pieces: list[Union[Point, ArcTo]] = []
+
+    def finish(closed: bool) -> None:
+        if start is not None and pieces:
+            outlines.append(Outline(start, simplify(start, pieces, closed), closed))
+
+    for segment in path.segments():
+        if isinstance(segment, Move):
+            finish(False)
+            start, pieces = (segment.end.x, segment.end.y), []
+        elif isinstance(segment, Close):
+            finish(True)
+            start, pieces = None, []
+        else:
+            if start is None:
+                start, pieces = (segment.start.x, segment.start.y), []
+            pieces += segment_pieces(segment, tolerance)
+    finish(False)
+
+    return outlines
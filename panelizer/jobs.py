@@ -0,0 +1,157 @@
+"""
+Background queue running conversions outside of the request that submitted them
+"""
+import contextlib
+import os
+import os.path
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from io import BytesIO
+from typing import TYPE_CHECKING, Callable, Optional
+
+from .admission import Admission
+
+if TYPE_CHECKING:
+    from .convert import PCB
+    from .cost import Estimate
+
+# Finished jobs (and their results) are forgotten after this many seconds
+JOB_TTL = 60 * 60
+
+
+class QueueFull(Exception):
+    pass
+
+
+def pending_stages() -> dict[str, str]:
+    # The conversion stack is only imported once a job is submitted
+    from .convert import STAGES
+
+    return {stage: "pending" for stage in STAGES}
+
+
+@dataclass
+class Job:
+    name: str
+    id: str = field(default_factory=lambda: uuid.uuid4().hex)
+    status: str = "queued"
+    stages: dict[str, str] = field(default_factory=pending_stages)
+    error: Optional[str] = None
+    result_path: Optional[str] = None
+    finished: Optional[float] = None
+
+    def progress(self, stage: str) -> None:
+        for previous, state in self.stages.items():
+            if state == "running":
+                self.stages[previous] = "done"
+        self.stages[stage] = "running"
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "name": self.name,
+            "status": self.status,
+            "stages": dict(self.stages),
+            "error": self.error,
+        }
+
+
+class JobQueue:
+    """
+    Runs conversions on `workers` threads, accepting at most `max_pending`
+    jobs that are queued or running at any time. With an `admission`, panels
+    predicted to exceed its budget are rejected on submission and the others
+    stay queued until they fit in it.
+    """
+
+    def __init__(
+        self,
+        convert: Callable[..., "PCB"],
+        workers: int,
+        max_pending: int,
+        directory: Optional[str] = None,
+        admission: Optional[Admission] = None,
+    ):
+        self.convert = convert
+        self.admission = admission
+        self.executor = ThreadPoolExecutor(workers, thread_name_prefix="job")
+        self.slots = threading.BoundedSemaphore(max_pending)
+        self.directory = directory or tempfile.mkdtemp(prefix="panelizer-jobs-")
+        self.jobs: dict[str, Job] = {}
+        self.lock = threading.Lock()
+
+        os.makedirs(self.directory, exist_ok=True)
+
+    def submit(self, svg: bytes, name: str) -> Job:
+        cost = None
+        if self.admission is not None:
+            from .cost import estimate
+
+            cost = estimate(svg)
+            self.admission.check(cost)
+
+        if not self.slots.acquire(blocking=False):
+            raise QueueFull()
+
+        self.expire()
+
+        job = Job(name=name)
+        with self.lock:
+            self.jobs[job.id] = job
+
+        self.executor.submit(self.run, job, svg, cost)
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def run(self, job: Job, svg: bytes, cost: Optional["Estimate"] = None) -> None:
+        admitted = (
+            contextlib.nullcontext()
+            if cost is None
+            else self.admission.admit(cost, job.name)
+        )
+        try:
+            with admitted:
+                job.status = "running"
+                panel = self.convert(BytesIO(svg), job.name, progress=job.progress)
+
+            result_path = os.path.join(self.directory, f"{job.id}.kicad_pcb")
+            with open(result_path, "wb") as fh:
+                for chunk in panel.iter_write():
+                    fh.write(chunk)
+
+            job.result_path = result_path
+            job.stages = {stage: "done" for stage in job.stages}
+            job.status = "done"
+        # pylint: disable-next=broad-except
+        except Exception as error:
+            job.stages = {
+                stage: "failed" if state == "running" else state
+                for stage, state in job.stages.items()
+            }
+            job.error = str(error)
+            job.status = "failed"
+        finally:
+            job.finished = time.monotonic()
+            self.slots.release()
+
+    def expire(self) -> None:
+        now = time.monotonic()
+        with self.lock:
+            expired = [
+                job
+                for job in self.jobs.values()
+                if job.finished is not None and now - job.finished > JOB_TTL
+            ]
+            for job in expired:
+                del self.jobs[job.id]
+
+        for job in expired:
+            if job.result_path is not None and os.path.exists(job.result_path):
+                os.remove(job.result_path)
@@ -0,0 +1,283 @@
+"""
+Per-stage timings, exposed as Server-Timing headers and Prometheus metrics
+"""
+import contextlib
+import contextvars
+import resource
+import sys
+import threading
+import time
+from collections import defaultdict
+from typing import Any, Callable, Iterator, NamedTuple, Optional
+
+import psutil
+
+# Seconds between the RSS samples taken while an admitted conversion runs
+RSS_SAMPLE_INTERVAL = 0.05
+
+METRICS = {
+    "panelizer_stage_calls_total": ("counter", "Number of times a stage ran"),
+    "panelizer_stage_seconds_total": ("counter", "Wall time spent in a stage"),
+    "panelizer_stage_cpu_seconds_total": ("counter", "CPU time spent in a stage"),
+    "panelizer_stage_peak_memory_bytes_total": (
+        "counter",
+        "Growth of the process peak RSS while a stage ran",
+    ),
+    "panelizer_trace_items_total": ("counter", "Polygons traced per layer"),
+    "panelizer_trace_points_total": ("counter", "Polygon vertices traced per layer"),
+    "panelizer_simplify_input_points_total": (
+        "counter",
+        "Traced polygon vertices per layer before simplification",
+    ),
+    "panelizer_simplify_output_points_total": (
+        "counter",
+        "Traced polygon vertices per layer after simplification",
+    ),
+    "panelizer_admission_predicted_memory_bytes_total": (
+        "counter",
+        "Peak memory predicted for admitted conversions that ran alone",
+    ),
+    "panelizer_admission_predicted_seconds_total": (
+        "counter",
+        "Wall time predicted for admitted conversions",
+    ),
+    "panelizer_admission_peak_memory_bytes_total": (
+        "counter",
+        "Growth of the RSS of the server and its workers while admitted "
+        "conversions ran alone",
+    ),
+    "panelizer_admission_seconds_total": (
+        "counter",
+        "Wall time admitted conversions took",
+    ),
+    "panelizer_admission_rejected_total": (
+        "counter",
+        "Conversions turned away by the admission scheduler",
+    ),
+    "panelizer_output_bytes_total": ("counter", "Bytes of generated documents"),
+    "panelizer_peak_rss_bytes": ("gauge", "Peak RSS of the process"),
+}
+
+
+class StageTiming(NamedTuple):
+    name: str
+    wall: float
+    cpu: float
+    memory: int
+
+
+class Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.values: defaultdict[tuple[str, tuple], float] = defaultdict(float)
+
+    def add(self, metric: str, value: float, **labels: str) -> None:
+        key = (metric, tuple(sorted(labels.items())))
+        with self.lock:
+            self.values[key] += value
+
+    def render(self) -> str:
+        with self.lock:
+            values = dict(self.values)
+        values[("panelizer_peak_rss_bytes", ())] = peak_rss()
+
+        lines = []
+        for metric, (metric_type, description) in METRICS.items():
+            lines.append(f"# HELP {metric} {description}")
+            lines.append(f"# TYPE {metric} {metric_type}")
+            for (name, labels), value in sorted(values.items()):
+                if name != metric:
+                    continue
+                label_text = ",".join(f'{key}="{val}"' for key, val in labels)
+                series = f"{metric}{{{label_text}}}" if labels else metric
+                lines.append(f"{series} {value}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+# Stages timed while handling the current request, None outside of requests
+TIMINGS: contextvars.ContextVar[Optional[list[StageTiming]]] = contextvars.ContextVar(
+    "timings", default=None
+)
+
+
+def peak_rss() -> int:
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return rss if sys.platform == "darwin" else rss * 1024
+
+
+def tree_rss(process: psutil.Process) -> int:
+    """RSS of `process` and its children, such as the layer and batch workers"""
+    rss = 0
+    for member in [process, *process.children(recursive=True)]:
+        try:
+            rss += member.memory_info().rss
+        except psutil.NoSuchProcess:
+            pass
+    return rss
+
+
+class RSSGrowth:
+    """How far the RSS sampled while a conversion ran rose past its start"""
+
+    def __init__(self, start: int):
+        self.start = self.peak = start
+        # Set when another measurement overlapped this one
+        self.shared = False
+
+
+class RSSSampler:
+    """
+    Samples the RSS of the process and its children on a single thread, while
+    any measurement is open. Unlike the peak RSS, it also sees memory that
+    earlier conversions freed being reused.
+
+    The process tree is shared by everything running at once, so the growth
+    of overlapping measurements can't be told apart and isn't reported.
+    """
+
+    def __init__(self, interval: float = RSS_SAMPLE_INTERVAL):
+        self.interval = interval
+        self.condition = threading.Condition()
+        self.measuring: list[RSSGrowth] = []
+        self.thread: Optional[threading.Thread] = None
+
+    def start(self) -> RSSGrowth:
+        growth = RSSGrowth(tree_rss(psutil.Process()))
+        with self.condition:
+            if self.measuring:
+                growth.shared = True
+                for other in self.measuring:
+                    other.shared = True
+            self.measuring.append(growth)
+
+            if self.thread is None:
+                self.thread = threading.Thread(
+                    target=self.sample, name="rss-sampler", daemon=True
+                )
+                self.thread.start()
+            self.condition.notify()
+        return growth
+
+    def stop(self, growth: RSSGrowth) -> Optional[int]:
+        """The growth of `growth`, None when other measurements overlapped it"""
+        rss = tree_rss(psutil.Process())
+        with self.condition:
+            self.measuring.remove(growth)
+            growth.peak = max(growth.peak, rss)
+        if growth.shared:
+            return None
+        return growth.peak - growth.start
+
+    def sample(self) -> None:
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.measuring)
+                measuring = list(self.measuring)
+            rss = tree_rss(psutil.Process())
+            with self.condition:
+                for growth in measuring:
+                    growth.peak = max(growth.peak, rss)
+            time.sleep(self.interval)
+
+
+RSS_SAMPLER = RSSSampler()
+
+
+@contextlib.contextmanager
+def timed(name: str) -> Iterator[None]:
+    wall, cpu, rss = time.perf_counter(), time.thread_time(), peak_rss()
+    try:
+        yield
+    finally:
+        timing = StageTiming(
+            name,
+            wall=time.perf_counter() - wall,
+            cpu=time.thread_time() - cpu,
+            memory=peak_rss() - rss,
+        )
+        record(timing, TIMINGS.get())
+
+
+def record(timing: StageTiming, timings: Optional[list[StageTiming]]) -> None:
+    """Adds `timing` to the metrics, and to `timings` when handling a request"""
+    REGISTRY.add("panelizer_stage_calls_total", 1, stage=timing.name)
+    REGISTRY.add("panelizer_stage_seconds_total", timing.wall, stage=timing.name)
+    REGISTRY.add("panelizer_stage_cpu_seconds_total", timing.cpu, stage=timing.name)
+    REGISTRY.add(
+        "panelizer_stage_peak_memory_bytes_total", timing.memory, stage=timing.name
+    )
+
+    if timings is not None:
+        timings.append(timing)
+
+
+def collect_timings(fn: Callable, *args, **kwargs) -> tuple[Any, list[StageTiming]]:
+    """
+    Runs `fn` in a worker process, returns its result along with the stages it
+    timed, for the process that submitted it to record.
+    """
+    token = TIMINGS.set([])
+    try:
+        return fn(*args, **kwargs), TIMINGS.get()
+    finally:
+        TIMINGS.reset(token)
+
+
+def count_trace(layer: str, traced: str) -> None:
+    REGISTRY.add("panelizer_trace_items_total", traced.count("(fp_poly"), layer=layer)
+    REGISTRY.add("panelizer_trace_points_total", traced.count("(xy "), layer=layer)
+
+
+def count_simplified(layer: str, before: int, after: int) -> None:
+    REGISTRY.add("panelizer_simplify_input_points_total", before, layer=layer)
+    REGISTRY.add("panelizer_simplify_output_points_total", after, layer=layer)
+
+
+def count_admission(
+    predicted_memory: int,
+    predicted_seconds: float,
+    memory: Optional[int],
+    seconds: float,
+) -> None:
+    REGISTRY.add("panelizer_admission_predicted_seconds_total", predicted_seconds)
+    REGISTRY.add("panelizer_admission_seconds_total", seconds)
+    # Conversions that overlapped others have no memory of their own
+    if memory is not None:
+        REGISTRY.add(
+            "panelizer_admission_predicted_memory_bytes_total", predicted_memory
+        )
+        REGISTRY.add("panelizer_admission_peak_memory_bytes_total", memory)
+
+
+def count_rejected(reason: str) -> None:
+    REGISTRY.add("panelizer_admission_rejected_total", 1, reason=reason)
+
+
+def count_output(document: str, size: int) -> None:
+    REGISTRY.add("panelizer_output_bytes_total", size, document=document)
+
+
+def server_timing(timings: list[StageTiming]) -> str:
+    """
+    One entry per stage, in the order they first ran. Stages that ran more
+    than once, such as the render of each region, are summed with a count so
+    that the header stays short on large panels.
+    """
+    stages: dict[str, tuple[int, float, float, int]] = {}
+    for timing in timings:
+        calls, wall, cpu, memory = stages.get(timing.name, (0, 0.0, 0.0, 0))
+        stages[timing.name] = (
+            calls + 1,
+            wall + timing.wall,
+            cpu + timing.cpu,
+            max(memory, timing.memory),
+        )
+
+    return ", ".join(
+        f"{name};dur={wall * 1000:.1f};"
+        f'desc="{calls}x, cpu {cpu * 1000:.1f}ms, peak +{memory // 1024}KiB"'
+        for name, (calls, wall, cpu, memory) in stages.items()
+    )
@@ -0,0 +1,24 @@
+"""
+Page dimensions and the resolution and memory layers are rendered with, kept
+apart from the rendering stack so the cost model can read them cheaply
+"""
+import os
+
+from lxml import etree
+
+MM_PER_INCH = 25.4
+
+# Resolution the raster layers are rendered and traced at
+DPI = 2540
+
+BYTES_PER_PIXEL = 4
+
+# Largest ARGB surface (in bytes) rendered in one go, anything bigger is
+# rendered and traced in tiles.
+MEMORY_BUDGET = int(os.environ.get("PANELIZER_MEMORY_BUDGET", 256 * 1024 * 1024))
+
+
+def page_size(root: etree._Element) -> tuple[float, float]:
+    width = float(root.get("width").replace("mm", ""))
+    height = float(root.get("height").replace("mm", ""))
+    return width, height
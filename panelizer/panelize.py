@@ -0,0 +1,124 @@
+"""
+Tiles many panels into a single board, converting each distinct panel once
+"""
+import contextlib
+import hashlib
+from concurrent.futures import Executor, Future
+from io import BytesIO
+from typing import Iterator, NamedTuple, Optional
+
+from lxml import etree
+
+from .admission import Admission
+from .convert import PCB, convert_panel
+from .cost import estimate
+from .metrics import timed
+from .page import page_size
+
+
+class Module(NamedTuple):
+    name: str
+    svg: bytes
+    # copies of the panel on the board
+    count: int = 1
+
+
+class Layout(NamedTuple):
+    # gap (in mm) between neighbouring panels
+    spacing: float = 2.0
+    # panels wrap onto a new row past this width (in mm), None keeps one row
+    max_width: Optional[float] = None
+
+
+class Converted(NamedTuple):
+    width: float
+    height: float
+    items: list
+
+
+def convert_module(svg: bytes, name: str) -> Converted:
+    """Converts a panel at the origin, runs on the panelize executor"""
+    _, root = next(etree.iterparse(BytesIO(svg), events=("start",)))
+    width, height = page_size(root)
+    return Converted(width, height, convert_panel(BytesIO(svg), name).items)
+
+
+def arrange(
+    sizes: list[tuple[float, float]], layout: Layout
+) -> Iterator[tuple[float, float]]:
+    """Positions panels of `sizes` left to right, in rows"""
+    x, y, row_height = 0.0, 0.0, 0.0
+    for width, height in sizes:
+        if layout.max_width is not None and x > 0 and x + width > layout.max_width:
+            x, y, row_height = 0.0, y + row_height + layout.spacing, 0.0
+
+        yield x, y
+        x += width + layout.spacing
+        row_height = max(row_height, height)
+
+
+def submit_module(
+    executor: Executor, module: Module, admission: Optional[Admission]
+) -> Future:
+    if admission is None:
+        return executor.submit(convert_module, module.svg, module.name)
+    return admission.submit(
+        executor,
+        estimate(module.svg),
+        module.name,
+        convert_module,
+        module.svg,
+        module.name,
+    )
+
+
+def panelize(
+    modules: list[Module],
+    name: str,
+    layout: Layout = Layout(),
+    executor: Optional[Executor] = None,
+    admission: Optional[Admission] = None,
+) -> PCB:
+    """
+    Converts each distinct panel of `modules` once, on `executor` when given,
+    and places its items once per copy on a single board. With an `admission`,
+    each panel is converted once it fits in the budget.
+    """
+    digests = [hashlib.sha256(module.svg).hexdigest() for module in modules]
+    unique: dict[str, Module] = {}
+    for digest, module in zip(digests, modules):
+        unique.setdefault(digest, module)
+
+    with timed("panelize_convert"):
+        if executor is not None:
+            futures = {
+                digest: submit_module(executor, module, admission)
+                for digest, module in unique.items()
+            }
+            converted = {digest: future.result() for digest, future in futures.items()}
+        else:
+            converted = {}
+            for digest, module in unique.items():
+                admitted = (
+                    contextlib.nullcontext()
+                    if admission is None
+                    else admission.admit(estimate(module.svg), module.name)
+                )
+                with admitted:
+                    converted[digest] = convert_module(module.svg, module.name)
+
+    copies = [
+        digest for digest, module in zip(digests, modules) for _ in range(module.count)
+    ]
+    board = PCB(title=name, company="mlon")
+    with timed("panelize_place"):
+        positions = arrange(
+            [(converted[digest].width, converted[digest].height) for digest in copies],
+            layout,
+        )
+        for digest, position in zip(copies, positions):
+            board.offset = position
+            board.place(converted[digest].items)
+    board.offset = (0, 0)
+
+    return board
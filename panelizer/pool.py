@@ -0,0 +1,104 @@
+"""
+Process pools that replace themselves once a dead worker breaks them
+"""
+import multiprocessing
+import threading
+from concurrent.futures import Executor, Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Optional
+
+from .metrics import TIMINGS, collect_timings, record
+
+
+def is_broken(future: Future) -> bool:
+    """Whether `future` failed because a worker of its pool died"""
+    return (
+        future.done()
+        and not future.cancelled()
+        and isinstance(future.exception(), BrokenProcessPool)
+    )
+
+
+class RestartingPool(Executor):
+    """
+    A pool of `workers` processes, started on first use. A worker that dies,
+    killed for running out of memory for instance, breaks a
+    ProcessPoolExecutor for good: everything it was running or queueing fails,
+    and so does everything submitted to it later. The broken executor is
+    replaced by a fresh one instead, so only the tasks in flight fail with it.
+    """
+
+    def __init__(
+        self,
+        workers: Optional[int] = None,
+        initializer: Optional[Callable[[], None]] = None,
+    ):
+        self.workers = workers
+        self.initializer = initializer
+        self.lock = threading.Lock()
+        self.executor: Optional[ProcessPoolExecutor] = None
+
+    def create(self, workers: Optional[int]) -> ProcessPoolExecutor:
+        # forkserver keeps the workers clear of the server's threads
+        return ProcessPoolExecutor(
+            workers,
+            mp_context=multiprocessing.get_context("forkserver"),
+            initializer=self.initializer,
+        )
+
+    def alone(self) -> "RestartingPool":
+        """A separate pool of a single worker, set up like the others"""
+        return RestartingPool(1, self.initializer)
+
+    def current(self) -> ProcessPoolExecutor:
+        with self.lock:
+            if self.executor is None:
+                self.executor = self.create(self.workers)
+            return self.executor
+
+    def replace(self, broken: ProcessPoolExecutor) -> None:
+        # A broken executor terminates its workers itself, the next caller
+        # gets a new one unless another one already replaced it.
+        with self.lock:
+            if self.executor is broken:
+                self.executor = None
+
+    def submit(self, fn, /, *args, **kwargs) -> Future:
+        """
+        Submits `fn(*args, **kwargs)`, the stages it times in the worker are
+        recorded as if it ran in the submitting request.
+        """
+        executor = self.current()
+        try:
+            submitted = executor.submit(collect_timings, fn, *args, **kwargs)
+        except BrokenProcessPool:
+            self.replace(executor)
+            executor = self.current()
+            submitted = executor.submit(collect_timings, fn, *args, **kwargs)
+
+        timings = TIMINGS.get()
+        future: Future = Future()
+
+        def resolve(done: Future) -> None:
+            if done.cancelled():
+                future.cancel()
+                return
+            if done.exception() is not None:
+                if is_broken(done):
+                    self.replace(executor)
+                future.set_exception(done.exception())
+                return
+
+            result, worker_timings = done.result()
+            for timing in worker_timings:
+                record(timing, timings)
+            future.set_result(result)
+
+        submitted.add_done_callback(resolve)
+        return future
+
+    def shutdown(self, wait: bool = True, *, cancel_futures: bool = False) -> None:
+        with self.lock:
+            executor, self.executor = self.executor, None
+        if executor is not None:
+            executor.shutdown(wait, cancel_futures=cancel_futures)
@@ -0,0 +1,721 @@
+"""
+Renders SVG layers to bitmaps and traces them into KiCad footprints
+"""
+import functools
+import math
+import os
+from copy import deepcopy
+from typing import NamedTuple, Optional, Sequence
+
+import gdstk
+import numpy as np
+from gingerbread.trace import _trace_bitmap_to_polys, generate_footprint
+from lxml import etree
+
+from .geometry import douglas_peucker
+from .metrics import count_simplified, timed
+from .page import BYTES_PER_PIXEL, MEMORY_BUDGET, MM_PER_INCH, page_size
+from .rasterizers import RASTERIZER
+from .symbols import Placement
+
+# Content is located on a render this many times coarser than the final one
+PREVIEW_SCALE = 8
+
+# Regions are rendered this far (in mm) past the content found in the preview
+REGION_MARGIN = 0.25
+
+# Blank strips narrower than this (in mm) don't split the content into regions
+REGION_GAP = 5
+
+# Tiles are rendered this far (in mm) past their edges so that potrace sees the
+# same outlines around a seam as it would on a single surface.
+TILE_OVERLAP = 0.5
+
+
+class Region(NamedTuple):
+    # Pixel bounds at the final resolution, right and bottom exclusive
+    left: int
+    top: int
+    right: int
+    bottom: int
+
+
+class Tile(NamedTuple):
+    # Part of a region traced from one render, and the part rendered around it
+    traced: Region
+    rendered: Region
+
+
+class Simplification(NamedTuple):
+    # Largest distance (in mm) an outline may move when vertices are dropped
+    tolerance: float
+    # Polygons smaller than this (in mm²) are dropped
+    min_area: float
+    # Overlapping and touching polygons are merged into one
+    merge: bool
+
+
+def layer_simplification(layer: str) -> Simplification:
+    """
+    Reads the simplification of `layer` from the environment, where
+    PANELIZER_SIMPLIFY_TOLERANCE_F_CU overrides PANELIZER_SIMPLIFY_TOLERANCE
+    for F.Cu, and likewise for the other settings.
+    """
+    suffix = layer.upper().replace(".", "_")
+
+    def setting(name: str, default: str) -> str:
+        return os.environ.get(
+            f"PANELIZER_SIMPLIFY_{name}_{suffix}",
+            os.environ.get(f"PANELIZER_SIMPLIFY_{name}", default),
+        )
+
+    return Simplification(
+        tolerance=float(setting("TOLERANCE", "0.005")),
+        min_area=float(setting("MIN_AREA", "0.001")),
+        merge=setting("MERGE", "1") != "0",
+    )
+
+
+def view_box(root: etree._Element) -> tuple[float, float, float, float]:
+    view_box_attr = root.get("viewBox")
+    if view_box_attr is None:
+        return (0, 0, *page_size(root))
+
+    x, y, w, h = (float(v) for v in view_box_attr.replace(",", " ").split())
+    return x, y, w, h
+
+
+def surface_size(svg: etree._ElementTree, dpi: float) -> tuple[int, int]:
+    width, height = page_size(svg.getroot())
+    return round(width * dpi / MM_PER_INCH), round(height * dpi / MM_PER_INCH)
+
+
+def render(
+    svg: etree._ElementTree | bytes,
+    *,
+    dpi: float,
+    invert: bool = False,
+    transparent: bool = False,
+    size: Optional[tuple[int, int]] = None,
+):
+    """Renders `svg` with the configured rasterizer, `size` pixels when given"""
+    if isinstance(svg, etree._ElementTree):
+        svg = etree.tostring(svg)
+
+    return RASTERIZER.render(
+        svg, dpi=dpi, invert=invert, transparent=transparent, size=size
+    )
+
+
+def crop(svg: etree._ElementTree, region: Region, dpi: float) -> bytes:
+    """Serializes the part of `svg` covering the pixels of `region` at `dpi`"""
+    px_per_mm = dpi / MM_PER_INCH
+    left, top = region.left / px_per_mm, region.top / px_per_mm
+    width = (region.right - region.left) / px_per_mm
+    height = (region.bottom - region.top) / px_per_mm
+
+    root = svg.getroot()
+    original = {key: root.get(key) for key in ("width", "height", "viewBox")}
+
+    x, y, w, h = view_box(root)
+    page_width, page_height = page_size(root)
+    scale_x, scale_y = w / page_width, h / page_height
+    root.set("width", f"{width}mm")
+    root.set("height", f"{height}mm")
+    root.set(
+        "viewBox",
+        f"{x + left * scale_x} {y + top * scale_y} "
+        f"{width * scale_x} {height * scale_y}",
+    )
+
+    try:
+        return etree.tostring(svg)
+    finally:
+        for key, value in original.items():
+            if value is None:
+                del root.attrib[key]
+            else:
+                root.set(key, value)
+
+
+def runs(values: np.ndarray, min_gap: int) -> list[tuple[int, int]]:
+    """(first, last) indices of the runs of True separated by `min_gap` Falses"""
+    indices = np.flatnonzero(values)
+    if len(indices) == 0:
+        return []
+
+    breaks = np.flatnonzero(np.diff(indices) > min_gap)
+    firsts = np.concatenate([indices[:1], indices[breaks + 1]])
+    lasts = np.concatenate([indices[breaks], indices[-1:]])
+    return list(zip(firsts.tolist(), lasts.tolist()))
+
+
+def content_boxes(
+    painted: np.ndarray, min_gap: int, split_columns: bool = False
+) -> list[tuple[int, int, int, int]]:
+    """
+    (left, top, right, bottom) of the painted pixels, right and bottom
+    exclusive, in horizontal strips separated by more than `min_gap` blank
+    rows. With `split_columns` strips are split across blank columns too, and
+    so on until none of the boxes splits any further.
+    """
+    boxes = []
+    row_runs = runs(painted.any(axis=1), min_gap)
+    for first_row, last_row in row_runs:
+        strip = painted[first_row : last_row + 1]
+        columns = strip.any(axis=0)
+        if not split_columns:
+            painted_columns = np.flatnonzero(columns)
+            boxes.append(
+                (
+                    int(painted_columns[0]),
+                    first_row,
+                    int(painted_columns[-1]) + 1,
+                    last_row + 1,
+                )
+            )
+            continue
+
+        column_runs = runs(columns, min_gap)
+        for first_column, last_column in column_runs:
+            if len(row_runs) == 1 and len(column_runs) == 1:
+                boxes.append((first_column, first_row, last_column + 1, last_row + 1))
+                continue
+
+            boxes += [
+                (
+                    first_column + left,
+                    first_row + top,
+                    first_column + right,
+                    first_row + bottom,
+                )
+                for left, top, right, bottom in content_boxes(
+                    strip[:, first_column : last_column + 1], min_gap, True
+                )
+            ]
+    return boxes
+
+
+def content_regions(
+    svg: etree._ElementTree,
+    *,
+    invert: bool,
+    dpi: float,
+    transparent: bool = False,
+    gap: float = REGION_GAP,
+    split_columns: bool = False,
+) -> list[Region]:
+    """
+    Finds the parts of the page `svg` draws on from a low resolution render,
+    horizontal strips separated by at least `gap` mm of blank page, or with
+    `split_columns` boxes separated by as much blank page in either direction.
+    """
+    with timed("preview"):
+        image = render(
+            svg, dpi=dpi / PREVIEW_SCALE, invert=invert, transparent=transparent
+        )
+        preview = RASTERIZER.painted(image, transparent)
+
+    width_px, height_px = surface_size(svg, dpi)
+    px_per_mm = dpi / MM_PER_INCH
+    margin = PREVIEW_SCALE + math.ceil(REGION_MARGIN * px_per_mm)
+    min_gap = math.ceil(gap * px_per_mm / PREVIEW_SCALE)
+
+    return [
+        Region(
+            left=max(left * PREVIEW_SCALE - margin, 0),
+            top=max(top * PREVIEW_SCALE - margin, 0),
+            right=min(right * PREVIEW_SCALE + margin, width_px),
+            bottom=min(bottom * PREVIEW_SCALE + margin, height_px),
+        )
+        for left, top, right, bottom in content_boxes(preview, min_gap, split_columns)
+    ]
+
+
+def contains(region: Region, other: Region) -> bool:
+    return (
+        region.left <= other.left
+        and region.top <= other.top
+        and other.right <= region.right
+        and other.bottom <= region.bottom
+    )
+
+
+def intersection(region: Region, other: Region) -> Optional[Region]:
+    """The part of `other` inside `region`, None when they don't overlap"""
+    clipped = Region(
+        left=max(region.left, other.left),
+        top=max(region.top, other.top),
+        right=min(region.right, other.right),
+        bottom=min(region.bottom, other.bottom),
+    )
+    if clipped.left >= clipped.right or clipped.top >= clipped.bottom:
+        return None
+    return clipped
+
+
+def stitch(polys: list[gdstk.Polygon], tiles: list[Tile]) -> list[gdstk.Polygon]:
+    """Merges the polygons that were split across the seams between `tiles`"""
+    rows = {tile.traced.top for tile in tiles} - {tiles[0].traced.top}
+    columns = {tile.traced.left for tile in tiles} - {tiles[0].traced.left}
+
+    split, whole = [], []
+    for poly in polys:
+        (x_min, y_min), (x_max, y_max) = poly.bounding_box()
+        if any(y_min <= seam <= y_max for seam in rows) or any(
+            x_min <= seam <= x_max for seam in columns
+        ):
+            split.append(poly)
+        else:
+            whole.append(poly)
+
+    if not split:
+        return whole
+
+    return whole + gdstk.boolean(split, [], "or")
+
+
+def simplify_polys(
+    polys: list[gdstk.Polygon],
+    simplification: Simplification,
+    *,
+    layer: str,
+    dpi: float,
+) -> list[gdstk.Polygon]:
+    """Merges, filters and simplifies traced polygons, measured in pixels"""
+    px_per_mm = dpi / MM_PER_INCH
+    tolerance = simplification.tolerance * px_per_mm
+    min_area = simplification.min_area * px_per_mm**2
+    before = sum(len(poly.points) for poly in polys)
+
+    if simplification.merge and len(polys) > 1:
+        polys = gdstk.boolean(polys, [], "or")
+
+    simplified = []
+    for poly in polys:
+        if poly.area() < min_area:
+            continue
+        if tolerance > 0:
+            points = douglas_peucker(poly.points, tolerance)
+            if len(points) < 3:
+                continue
+            poly = gdstk.Polygon(points)
+        simplified.append(poly)
+
+    count_simplified(layer, before, sum(len(poly.points) for poly in simplified))
+    return simplified
+
+
+def tiles(region: Region, *, dpi: float, memory_budget: int) -> list[Tile]:
+    """
+    Splits `region` into tiles that fit within `memory_budget` with the
+    overlap rendered around them, in reading order. Those are horizontal bands
+    as wide as the region, or squares when not even one row fits across it. A
+    single tile when the region fits as a whole.
+    """
+    width = region.right - region.left
+    height = region.bottom - region.top
+    pixels = memory_budget // BYTES_PER_PIXEL
+    if width * height <= pixels:
+        return [Tile(region, region)]
+
+    overlap = math.ceil(TILE_OVERLAP * dpi / MM_PER_INCH)
+    if width * (1 + 2 * overlap) <= pixels:
+        columns, rows = width, pixels // width - 2 * overlap
+    else:
+        columns = rows = math.isqrt(pixels) - 2 * overlap
+        if rows < 1:
+            raise ValueError(
+                f"A memory budget of {memory_budget} bytes can't hold the "
+                f"{TILE_OVERLAP:g}mm overlap around a tile at {dpi:g}dpi, it "
+                f"needs at least {(1 + 2 * overlap) ** 2 * BYTES_PER_PIXEL} bytes"
+            )
+
+    return [
+        Tile(
+            traced=Region(
+                left=left,
+                top=top,
+                right=min(left + columns, region.right),
+                bottom=min(top + rows, region.bottom),
+            ),
+            rendered=Region(
+                left=max(left - overlap, region.left),
+                top=max(top - overlap, region.top),
+                right=min(left + columns + overlap, region.right),
+                bottom=min(top + rows + overlap, region.bottom),
+            ),
+        )
+        for top in range(region.top, region.bottom, rows)
+        for left in range(region.left, region.right, columns)
+    ]
+
+
+def render_region(
+    svg: etree._ElementTree,
+    region: Region,
+    *,
+    invert: bool,
+    dpi: float,
+    transparent: bool = False,
+):
+    # The size is passed in pixels, as the renderers round the page size in
+    # mm back to pixels either way
+    with timed("render"):
+        return render(
+            crop(svg, region, dpi),
+            dpi=dpi,
+            invert=invert,
+            transparent=transparent,
+            size=(region.right - region.left, region.bottom - region.top),
+        )
+
+
+def composite(image, overlay, x: int, y: int):
+    """`image` with `overlay` painted over it, top left corner at pixel (x, y)"""
+    with timed("composite"):
+        return RASTERIZER.composite(image, overlay, x, y)
+
+
+def mask(image) -> np.ndarray:
+    """Thresholds `image` into the boolean bitmap potrace traces"""
+    with timed("threshold"):
+        return RASTERIZER.mask(image)
+
+
+def trace_tile(bitmap: np.ndarray, tile: Tile) -> list[gdstk.Polygon]:
+    """Traces `tile` rendered and thresholded as `bitmap`, clipped to its own part"""
+    with timed("trace"):
+        polys = _trace_bitmap_to_polys(bitmap, center=False)
+
+    for poly in polys:
+        poly.translate(tile.rendered.left, tile.rendered.top)
+
+    if tile.rendered == tile.traced:
+        return polys
+
+    return gdstk.boolean(
+        polys,
+        gdstk.rectangle(
+            (tile.traced.left, tile.traced.top), (tile.traced.right, tile.traced.bottom)
+        ),
+        "and",
+    )
+
+
+def trace_region(
+    svg: etree._ElementTree,
+    region: Region,
+    *,
+    invert: bool,
+    dpi: float,
+    memory_budget: int,
+) -> list[gdstk.Polygon]:
+    """
+    Traces the pixels of `region`, rendered in tiles when it doesn't fit
+    within `memory_budget`.
+    """
+    polys: list[gdstk.Polygon] = []
+    region_tiles = tiles(region, dpi=dpi, memory_budget=memory_budget)
+    for tile in region_tiles:
+        image = render_region(svg, tile.rendered, invert=invert, dpi=dpi)
+        bitmap = mask(image)
+        # Only the bitmap is kept while tracing
+        del image
+        polys += trace_tile(bitmap, tile)
+
+    return stitch(polys, region_tiles)
+
+
+def trace_stacked_region(
+    svg: etree._ElementTree,
+    region: Region,
+    overlay: Optional[etree._ElementTree],
+    overlay_regions: list[Region],
+    *,
+    invert: bool,
+    dpi: float,
+    memory_budget: int,
+) -> tuple[list[gdstk.Polygon], list[gdstk.Polygon]]:
+    """
+    Traces the pixels of `region` like trace_region(), then paints the parts
+    of `overlay_regions` within each tile over the same render and traces
+    that again.
+    """
+    polys: list[gdstk.Polygon] = []
+    stacked_polys: list[gdstk.Polygon] = []
+    region_tiles = tiles(region, dpi=dpi, memory_budget=memory_budget)
+    for tile in region_tiles:
+        image = render_region(svg, tile.rendered, invert=invert, dpi=dpi)
+        bitmap = mask(image)
+
+        painted_over = False
+        for overlay_region in overlay_regions:
+            clipped = intersection(tile.rendered, overlay_region)
+            if clipped is None:
+                continue
+
+            patch = render_region(
+                overlay, clipped, invert=invert, dpi=dpi, transparent=True
+            )
+            image = composite(
+                image,
+                patch,
+                clipped.left - tile.rendered.left,
+                clipped.top - tile.rendered.top,
+            )
+            del patch
+            painted_over = True
+
+        stacked_bitmap = mask(image) if painted_over else None
+        # Only the bitmaps are kept while tracing
+        del image
+
+        tile_polys = trace_tile(bitmap, tile)
+        polys += tile_polys
+        if stacked_bitmap is not None:
+            stacked_polys += trace_tile(stacked_bitmap, tile)
+        else:
+            stacked_polys += [poly.copy() for poly in tile_polys]
+
+    return stitch(polys, region_tiles), stitch(stacked_polys, region_tiles)
+
+
+@functools.lru_cache(maxsize=256)
+def trace_symbol(
+    document: bytes, *, dpi: float, memory_budget: int
+) -> tuple[gdstk.Polygon, ...]:
+    """
+    Traces the page of a placed symbol, once per symbol and `dpi` in each
+    process, in pixels from its top left corner
+    """
+    svg = etree.ElementTree(etree.fromstring(document))
+    page = Region(0, 0, *surface_size(svg, dpi))
+    return tuple(
+        trace_region(svg, page, invert=False, dpi=dpi, memory_budget=memory_budget)
+    )
+
+
+def place(
+    polys: list[gdstk.Polygon],
+    placed: Sequence[Placement],
+    *,
+    invert: bool,
+    dpi: float,
+    memory_budget: int,
+) -> list[gdstk.Polygon]:
+    """
+    Adds the traces of the `placed` symbols to `polys`, or cuts them out of
+    `polys` traced inverted, where what the symbols draw is left blank.
+    """
+    if not placed:
+        return polys
+
+    px_per_mm = dpi / MM_PER_INCH
+    symbols = []
+    with timed("place"):
+        for placement in placed:
+            for poly in trace_symbol(
+                placement.document, dpi=dpi, memory_budget=memory_budget
+            ):
+                poly = poly.copy()
+                poly.translate(placement.x * px_per_mm, placement.y * px_per_mm)
+                symbols.append(poly)
+
+        return gdstk.boolean(polys, symbols, "not" if invert else "or")
+
+
+def footprint(
+    polys: list[gdstk.Polygon],
+    layer: str,
+    *,
+    dpi: float,
+    simplification: Optional[Simplification],
+) -> str:
+    if not polys:
+        return ""
+
+    if simplification is not None:
+        with timed("simplify"):
+            polys = simplify_polys(polys, simplification, layer=layer, dpi=dpi)
+
+    return generate_footprint(polys, dpi=dpi, layer=layer)
+
+
+def trace_regions(
+    svg: etree._ElementTree,
+    regions: list[Region],
+    layer: str,
+    *,
+    invert: bool = False,
+    dpi: float = 2540,
+    memory_budget: int = MEMORY_BUDGET,
+    simplification: Optional[Simplification] = None,
+    placed: Sequence[Placement] = (),
+) -> str:
+    """
+    Traces `regions` of `svg` into a single footprint with the `placed`
+    symbols, returns an empty string when nothing is drawn there.
+    """
+    polys: list[gdstk.Polygon] = []
+    for region in regions:
+        polys += trace_region(
+            svg, region, invert=invert, dpi=dpi, memory_budget=memory_budget
+        )
+    polys = place(polys, placed, invert=invert, dpi=dpi, memory_budget=memory_budget)
+
+    return footprint(polys, layer, dpi=dpi, simplification=simplification)
+
+
+def trace_svg(
+    svg: etree._ElementTree,
+    layer: str,
+    *,
+    invert: bool = False,
+    dpi: float = 2540,
+    memory_budget: int = MEMORY_BUDGET,
+    simplification: Optional[Simplification] = None,
+    placed: Sequence[Placement] = (),
+) -> str:
+    """
+    Traces the parts of `svg` that are drawn on with the `placed` symbols,
+    returns an empty string when nothing is.
+    """
+    return trace_regions(
+        svg,
+        content_regions(svg, invert=invert, dpi=dpi),
+        layer,
+        invert=invert,
+        dpi=dpi,
+        memory_budget=memory_budget,
+        simplification=simplification,
+        placed=placed,
+    )
+
+
+def stack(
+    svg: etree._ElementTree, overlay: Optional[etree._ElementTree]
+) -> etree._ElementTree:
+    """A copy of `svg` with the contents of `overlay` drawn over it"""
+    root = deepcopy(svg.getroot())
+    if overlay is not None:
+        root.extend(deepcopy(child) for child in overlay.getroot())
+    return etree.ElementTree(root)
+
+
+def trace_stacked(
+    svg: etree._ElementTree,
+    overlay: Optional[etree._ElementTree],
+    layers: tuple[str, str],
+    *,
+    invert: bool = False,
+    dpi: float = 2540,
+    memory_budget: int = MEMORY_BUDGET,
+    simplifications: tuple[Optional[Simplification], ...] = (None, None),
+    placed: tuple[Sequence[Placement], Sequence[Placement]] = ((), ()),
+) -> tuple[str, str]:
+    """
+    Traces `svg` as the first of `layers`, and `svg` with `overlay` drawn over
+    it as the second, each with its own `placed` symbols. `svg` is rendered
+    once, only the overlay is rendered again and painted over it.
+
+    Inverted, the page around what `svg` draws is white and so is the overlay
+    painted there, the overlay is only painted within the regions of `svg`.
+    Otherwise both are rendered in full unless those regions contain it.
+    """
+    layer, stacked_layer = layers
+    simplification, stacked_simplification = simplifications
+
+    regions = content_regions(svg, invert=invert, dpi=dpi)
+    overlay_regions = []
+    if overlay is not None:
+        overlay_regions = content_regions(
+            overlay, invert=invert, dpi=dpi, transparent=True
+        )
+
+    if not invert and not all(
+        any(contains(region, overlay_region) for region in regions)
+        for overlay_region in overlay_regions
+    ):
+        # The overlay draws where `svg` isn't rendered at all
+        return (
+            trace_svg(
+                svg,
+                layer,
+                invert=invert,
+                dpi=dpi,
+                memory_budget=memory_budget,
+                simplification=simplification,
+                placed=placed[0],
+            ),
+            trace_svg(
+                stack(svg, overlay),
+                stacked_layer,
+                invert=invert,
+                dpi=dpi,
+                memory_budget=memory_budget,
+                simplification=stacked_simplification,
+                placed=placed[1],
+            ),
+        )
+
+    polys: list[gdstk.Polygon] = []
+    stacked_polys: list[gdstk.Polygon] = []
+    for region in regions:
+        region_polys, region_stacked_polys = trace_stacked_region(
+            svg,
+            region,
+            overlay,
+            [
+                clipped
+                for clipped in (
+                    intersection(region, overlay_region)
+                    for overlay_region in overlay_regions
+                )
+                if clipped is not None
+            ],
+            invert=invert,
+            dpi=dpi,
+            memory_budget=memory_budget,
+        )
+        polys += region_polys
+        stacked_polys += region_stacked_polys
+
+    options = dict(invert=invert, dpi=dpi, memory_budget=memory_budget)
+    polys = place(polys, placed[0], **options)
+    stacked_polys = place(stacked_polys, placed[1], **options)
+    return (
+        footprint(polys, layer, dpi=dpi, simplification=simplification),
+        footprint(
+            stacked_polys,
+            stacked_layer,
+            dpi=dpi,
+            simplification=stacked_simplification,
+        ),
+    )
+
+
+def trace_svg_string(svg: bytes, layer: str, **kwargs) -> str:
+    """Same as trace_svg, but takes a serialized SVG so it can cross processes"""
+    return trace_svg(etree.ElementTree(etree.fromstring(svg)), layer, **kwargs)
+
+
+def trace_regions_string(
+    svg: bytes, regions: list[Region], layer: str, **kwargs
+) -> str:
+    """Same as trace_regions, but takes a serialized SVG"""
+    return trace_regions(
+        etree.ElementTree(etree.fromstring(svg)), regions, layer, **kwargs
+    )
+
+
+def trace_stacked_string(
+    svg: bytes, overlay: Optional[bytes], layers: tuple[str, str], **kwargs
+) -> tuple[str, str]:
+    """Same as trace_stacked, but takes serialized SVGs"""
+    return trace_stacked(
+        etree.ElementTree(etree.fromstring(svg)),
+        None if overlay is None else etree.ElementTree(etree.fromstring(overlay)),
+        layers,
+        **kwargs,
+    )
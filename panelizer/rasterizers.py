@@ -0,0 +1,233 @@
+"""
+Backends rendering SVG documents into the bitmaps that are traced
+"""
+import os
+import sys
+from typing import Any, Optional, Protocol
+
+import cairocffi
+import cairosvg
+import numpy as np
+import pyvips
+
+from .page import BYTES_PER_PIXEL
+
+WHITE = [255, 255, 255]
+
+# Pixels at or below this luminance are traced, as in gingerbread
+THRESHOLD = 127
+
+# Rows thresholded at once, bounding the temporaries of the luma sum
+MASK_ROWS = 256
+
+# librsvg refuses documents past its size and nesting limits unless this is set,
+# uploads are only trusted that far when it's opted into
+VIPS_UNLIMITED = os.environ.get("PANELIZER_VIPS_UNLIMITED", "0") != "0"
+
+# Byte offsets of the channels in cairo's native endian ARGB32 pixels
+RED, GREEN, BLUE = (2, 1, 0) if sys.byteorder == "little" else (1, 2, 3)
+
+
+class Rasterizer(Protocol):
+    name: str
+
+    def render(
+        self,
+        svg: bytes,
+        *,
+        dpi: float,
+        invert: bool = False,
+        transparent: bool = False,
+        size: Optional[tuple[int, int]] = None,
+    ) -> Any:
+        """
+        Renders `svg` at `dpi` over a white background, or a transparent one,
+        with its colours negated when `invert` is set. The image is `size`
+        pixels (width, height) when given, rather than the page size at `dpi`
+        rounded either way.
+        """
+
+    def painted(self, image: Any, transparent: bool = False) -> np.ndarray:
+        """Boolean mask of the pixels drawn on"""
+
+    def composite(self, image: Any, overlay: Any, x: int, y: int) -> Any:
+        """`image` with `overlay` painted over it, top left corner at (x, y)"""
+
+    def mask(self, image: Any) -> np.ndarray:
+        """
+        Boolean array of the dark pixels of an opaque `image`, the bitmap
+        handed to potrace
+        """
+
+
+class CairoRasterizer:
+    """Renders with cairosvg, single threaded, into cairo image surfaces"""
+
+    name = "cairosvg"
+
+    def render(
+        self,
+        svg: bytes,
+        *,
+        dpi: float,
+        invert: bool = False,
+        transparent: bool = False,
+        size: Optional[tuple[int, int]] = None,
+    ) -> cairocffi.ImageSurface:
+        width, height = size or (None, None)
+        # cairosvg truncates the page size at `dpi`, an explicit size is kept
+        surface = cairosvg.surface.PNGSurface(
+            cairosvg.parser.Tree(bytestring=svg),
+            output=None,
+            background_color=None if transparent or invert else "#fff",
+            dpi=dpi,
+            output_width=width,
+            output_height=height,
+        )
+        surface.cairo.flush()
+        if invert:
+            negate(surface.cairo, transparent)
+        return surface.cairo
+
+    def painted(
+        self, image: cairocffi.ImageSurface, transparent: bool = False
+    ) -> np.ndarray:
+        pixels = np.ndarray(
+            shape=(image.get_height(), image.get_stride() // BYTES_PER_PIXEL),
+            dtype=np.uint32,
+            buffer=image.get_data(),
+        )
+        blank = 0 if transparent else 0xFFFFFFFF
+        return pixels[:, : image.get_width()] != blank
+
+    def composite(
+        self,
+        image: cairocffi.ImageSurface,
+        overlay: cairocffi.ImageSurface,
+        x: int,
+        y: int,
+    ) -> cairocffi.ImageSurface:
+        context = cairocffi.Context(image)
+        context.set_source_surface(overlay, x, y)
+        context.paint()
+        image.flush()
+        return image
+
+    def mask(self, image: cairocffi.ImageSurface) -> np.ndarray:
+        height, width = image.get_height(), image.get_width()
+        data = np.ndarray(
+            shape=(height, image.get_stride()),
+            dtype=np.uint8,
+            buffer=image.get_data(),
+        )
+        channels = [
+            data[:, offset : width * BYTES_PER_PIXEL : BYTES_PER_PIXEL]
+            for offset in (RED, GREEN, BLUE)
+        ]
+
+        # Rec. 601 luma scaled by 256, the weights sum to 256
+        dark = np.empty((height, width), dtype=bool)
+        for top in range(0, height, MASK_ROWS):
+            rows = slice(top, top + MASK_ROWS)
+            red, green, blue = (channel[rows] for channel in channels)
+            luma = red.astype(np.uint16) * 77
+            luma += green.astype(np.uint16) * 150
+            luma += blue.astype(np.uint16) * 29
+            np.less(luma, (THRESHOLD + 1) * 256, out=dark[rows])
+        return dark
+
+
+class VipsRasterizer:
+    """
+    Renders with libvips (through librsvg), which evaluates the document in
+    tiles on a pool of threads, see VIPS_CONCURRENCY.
+
+    Images are lazy pipelines, only evaluated tile by tile when thresholded,
+    so no more than the boolean bitmap is held at once. An image read twice,
+    like the holes under the relief, is rendered again each time.
+    """
+
+    name = "vips"
+
+    def render(
+        self,
+        svg: bytes,
+        *,
+        dpi: float,
+        invert: bool = False,
+        transparent: bool = False,
+        size: Optional[tuple[int, int]] = None,
+    ) -> pyvips.Image:
+        image = pyvips.Image.svgload_buffer(svg, dpi=dpi, unlimited=VIPS_UNLIMITED)
+        if size is not None and (image.width, image.height) != size:
+            # The page size at `dpi` was rounded the other way, the edge is
+            # repeated or cut to the exact size
+            image = image.embed(0, 0, *size, extend="copy")
+        if invert:
+            image = image[:3].invert().bandjoin(image[3])
+        if not transparent:
+            image = image.flatten(background=WHITE)
+        return image
+
+    def painted(self, image: pyvips.Image, transparent: bool = False) -> np.ndarray:
+        pixels = image.numpy()
+        if transparent:
+            return pixels[:, :, 3] != 0
+        return (pixels[:, :, :3] != 255).any(axis=2)
+
+    def composite(
+        self, image: pyvips.Image, overlay: pyvips.Image, x: int, y: int
+    ) -> pyvips.Image:
+        return image.composite2(overlay, "over", x=x, y=y).flatten(background=WHITE)
+
+    def mask(self, image: pyvips.Image) -> np.ndarray:
+        # The same Rec. 601 luma as CairoRasterizer.mask rather than the b-w
+        # colourspace, so both backends threshold the same pixels. vips
+        # evaluates it tile by tile and only the boolean result is held.
+        luma = image[0] * 77 + image[1] * 150 + image[2] * 29
+        return (luma < (THRESHOLD + 1) * 256).numpy() != 0
+
+
+def negate(surface: cairocffi.ImageSurface, transparent: bool) -> None:
+    """
+    Negates the colours drawn on a transparent `surface` in place, then paints
+    it over white unless `transparent`. Pixels are premultiplied, so negating
+    what was drawn takes each colour channel from alpha to alpha minus itself,
+    and painting that over white takes it to 255 minus itself.
+    """
+    pixels = np.ndarray(
+        shape=(surface.get_height(), surface.get_stride() // BYTES_PER_PIXEL),
+        dtype=np.uint32,
+        buffer=surface.get_data(),
+    )[:, : surface.get_width()]
+
+    if transparent:
+        alpha = pixels >> 24
+        colour = pixels & 0x00FFFFFF
+        np.multiply(alpha, 0x00010101, out=alpha)
+        alpha -= colour
+        del colour
+        pixels &= 0xFF000000
+        pixels |= alpha
+    else:
+        pixels ^= 0x00FFFFFF
+        pixels |= 0xFF000000
+    surface.mark_dirty()
+
+
+RASTERIZERS: dict[str, type[Rasterizer]] = {
+    CairoRasterizer.name: CairoRasterizer,
+    VipsRasterizer.name: VipsRasterizer,
+}
+
+
+def rasterizer(name: str) -> Rasterizer:
+    try:
+        return RASTERIZERS[name]()
+    except KeyError:
+        raise ValueError(
+            f"Unknown rasterizer {name!r}, expected one of {', '.join(RASTERIZERS)}"
+        ) from None
+
+
+RASTERIZER = rasterizer(os.environ.get("PANELIZER_RASTERIZER", "cairosvg"))
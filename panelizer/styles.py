@@ -0,0 +1,47 @@
+"""
+Parses and recolors the inline styles of converted layers
+"""
+import functools
+import re
+from typing import Optional
+
+# Declarations of an inline style, semicolons inside quotes or parentheses
+# (e.g. data URIs) don't end a declaration.
+STYLE_DECLARATION = re.compile(r"""(?:[^;"'(]|"[^"]*"|'[^']*'|\([^)]*\))+""")
+STYLE_COMMENT = re.compile(r"/\*.*?\*/", re.DOTALL)
+
+
+def parse_style(style: str) -> dict[str, str]:
+    declarations = {}
+    for declaration in STYLE_DECLARATION.findall(STYLE_COMMENT.sub("", style)):
+        name, colon, value = declaration.partition(":")
+        name, value = name.strip().lower(), value.strip()
+        if colon and name and value:
+            declarations[name] = value
+    return declarations
+
+
+@functools.lru_cache(maxsize=4096)
+def recolor_style(
+    style: str, fill: Optional[str], stroke: Optional[str], force_fill: bool
+) -> str:
+    """
+    Paints the fill and stroke of an inline style black, `fill` and `stroke`
+    are the presentation attributes being folded into the style.
+    """
+    declarations = parse_style(style)
+
+    if fill is not None:
+        declarations["fill"] = fill
+
+    if force_fill or declarations.get("fill", "none") != "none":
+        declarations["fill"] = "#000"
+
+    if stroke is not None:
+        declarations["stroke"] = stroke
+
+    if declarations.get("stroke", "none") != "none":
+        declarations["stroke"] = "#000"
+
+    new_style = ";".join(f"{name}:{value}" for name, value in declarations.items())
+    return new_style.replace('"', "'")
@@ -0,0 +1,276 @@
+"""
+Symbol instances handled once per symbol rather than once per instance: the
+vector layers (Cuts and Alignment) are parsed once and transformed into place,
+the traced layers are traced once per symbol and DPI and placed by offset.
+"""
+import functools
+import math
+from contextlib import contextmanager
+from copy import deepcopy
+from io import BytesIO
+from typing import Iterator, NamedTuple, Optional
+
+from lxml import etree
+from svgelements import SVG, Group, Image, Matrix, Shape, Text
+
+from .page import MM_PER_INCH
+from .styles import parse_style
+
+SVG_NS = "http://www.w3.org/2000/svg"
+
+# Set by inline_symbols on the group replacing each <use> of a symbol
+SYMBOL_ATTR = "data-symbol"
+INSTANCE_ATTR = "data-symbol-instance"
+
+# Presentation attributes a symbol instance inherits from its ancestors
+INHERITED = ("fill", "stroke", "stroke-width")
+
+# Attributes drawing past the geometry of an object by an amount svgelements
+# doesn't measure
+UNMEASURED_ATTRIBUTES = ("filter", "marker", "marker-start", "marker-mid", "marker-end")
+
+# Attributes of an instance or its ancestors that change what it draws in a
+# way placing its trace would miss
+UNPLACEABLE_ATTRIBUTES = ("clip-path", "mask", "filter", "opacity")
+
+# Miter limit SVG joins are drawn with by default, a corner reaches that many
+# half stroke widths past the outline.
+MITER_LIMIT = 4
+
+
+class Placement(NamedTuple):
+    """
+    A symbol instance traced apart, `document` is the instance as a page of
+    its own and (`x`, `y`) where the top left corner of that page goes (in mm)
+    """
+
+    document: bytes
+    x: float
+    y: float
+
+
+@functools.lru_cache(maxsize=256)
+def symbol_shapes(document: bytes) -> tuple[Shape, ...]:
+    """Parses the shapes of a symbol instance in the symbol's own coordinates"""
+    return tuple(
+        SVG.parse(BytesIO(document), ppi=25.4).select(lambda el: isinstance(el, Shape))
+    )
+
+
+def instance_document(
+    children: list[etree._Element],
+    placeholder: Group,
+    transform: Optional[Matrix] = None,
+) -> bytes:
+    root = etree.Element(f"{{{SVG_NS}}}svg", nsmap={None: SVG_NS})
+    content = etree.SubElement(
+        root,
+        f"{{{SVG_NS}}}g",
+        attrib={
+            name: placeholder.values[name]
+            for name in INHERITED
+            if name in placeholder.values
+        },
+    )
+    if transform is not None:
+        content.set(
+            "transform",
+            f"matrix({transform.a!r} {transform.b!r} {transform.c!r} "
+            f"{transform.d!r} {transform.e!r} {transform.f!r})",
+        )
+    content.extend(deepcopy(child) for child in children)
+    return etree.tostring(root)
+
+
+def reifies(matrix: Matrix) -> bool:
+    return matrix.b == 0 and matrix.c == 0 and matrix.a > 0 and matrix.d > 0
+
+
+def outer_instances(root: etree._Element) -> list[etree._Element]:
+    """The symbol instances in `root` that aren't part of another instance"""
+    return [
+        group
+        for group in root.xpath(f".//*[@{SYMBOL_ATTR}]")
+        if not group.xpath(f"ancestor::*[@{SYMBOL_ATTR}]")
+    ]
+
+
+class Instances:
+    """
+    The instances of a layer emptied by parsed_instances(), each of them
+    serialized once per symbol and transform.
+    """
+
+    def __init__(self, groups: list[etree._Element]):
+        self.groups = groups
+        self.contents = [list(group) for group in groups]
+        self.documents: dict[tuple, bytes] = {}
+
+    def document(
+        self, placeholder: Group, transform: Optional[Matrix] = None
+    ) -> bytes:
+        index = int(placeholder.values[INSTANCE_ATTR])
+        key = (
+            self.groups[index].get(SYMBOL_ATTR),
+            tuple(placeholder.values.get(name) for name in INHERITED),
+            None
+            if transform is None
+            else (transform.a, transform.b, transform.c, transform.d)
+            + (transform.e, transform.f),
+        )
+        if key not in self.documents:
+            self.documents[key] = instance_document(
+                self.contents[index], placeholder, transform
+            )
+        return self.documents[key]
+
+
+@contextmanager
+def parsed_instances(root: etree._Element) -> Iterator[tuple[SVG, Instances]]:
+    """
+    Parses the layer `root` with the contents of its instances moved out of
+    the tree, each instance numbered with INSTANCE_ATTR. Only the instances
+    are edited, and put back as they were after the block.
+    """
+    instances = Instances(outer_instances(root))
+    for index, group in enumerate(instances.groups):
+        group.set(INSTANCE_ATTR, str(index))
+        group[:] = []
+
+    try:
+        yield (
+            SVG.parse(BytesIO(etree.tostring(etree.ElementTree(root))), ppi=25.4),
+            instances,
+        )
+    finally:
+        for group, children in zip(instances.groups, instances.contents):
+            del group.attrib[INSTANCE_ATTR]
+            group.extend(children)
+
+
+def select_shapes(root: etree._Element, types: tuple[type, ...]) -> Iterator[Shape]:
+    """
+    Parses the shapes of `types` in the layer `root`, in document order. Symbol
+    instances are parsed once per symbol and transformed into place, `root` is
+    left as it is.
+    """
+    shapes: list[Shape] = []
+    with parsed_instances(root) as (svg, instances):
+        for element in svg.select():
+            if isinstance(element, types):
+                shapes.append(element)
+            elif isinstance(element, Group) and INSTANCE_ATTR in element.values:
+                if not reifies(element.transform):
+                    # Shapes only take up positive scales and translations, so
+                    # the ones of flipped or rotated instances are parsed in
+                    # place like the rest of the layer
+                    document = instances.document(element, element.transform)
+                    shapes.extend(
+                        shape
+                        for shape in symbol_shapes(document)
+                        if isinstance(shape, types)
+                    )
+                    continue
+                for shape in symbol_shapes(instances.document(element)):
+                    if isinstance(shape, types):
+                        placed = shape * element.transform
+                        placed.reify()
+                        shapes.append(placed)
+
+    yield from shapes
+
+
+@functools.lru_cache(maxsize=256)
+def symbol_page(document: bytes, dpi: float) -> Optional[tuple[bytes, float, float]]:
+    """
+    `document` as a page just large enough for what it draws, with the
+    position (in mm) of its top left corner, which falls on a pixel at `dpi`.
+    None unless what it draws can be measured: glyphs, markers and filters are
+    only estimated and images without a size have no bounds to speak of.
+    """
+    parsed = SVG.parse(BytesIO(document), ppi=MM_PER_INCH)
+    boxes = []
+    margin = 0.0
+    for element in parsed.elements():
+        if isinstance(element, Text) or any(
+            element.values.get(name, "none") != "none"
+            for name in UNMEASURED_ATTRIBUTES
+        ):
+            return None
+        if isinstance(element, Shape):
+            box = element.bbox(with_stroke=True)
+            if element.stroke is not None and element.stroke.value is not None:
+                margin = max(margin, MITER_LIMIT * element.implicit_stroke_width / 2)
+        elif isinstance(element, Image):
+            box = element.bbox()
+            if box is None or box[0] >= box[2] or box[1] >= box[3]:
+                return None
+        else:
+            continue
+        if box is not None:
+            boxes.append(box)
+
+    if not boxes:
+        return None
+
+    px_per_mm = dpi / MM_PER_INCH
+    # A pixel more on each side for the antialiased edges
+    margin += 1 / px_per_mm
+    lefts, tops, rights, bottoms = zip(*boxes)
+    # Rounded first so that bounds falling on a pixel stay there
+    left = math.floor(round((min(lefts) - margin) * px_per_mm, 6)) / px_per_mm
+    top = math.floor(round((min(tops) - margin) * px_per_mm, 6)) / px_per_mm
+    right = math.ceil(round((max(rights) + margin) * px_per_mm, 6)) / px_per_mm
+    bottom = math.ceil(round((max(bottoms) + margin) * px_per_mm, 6)) / px_per_mm
+
+    root = etree.fromstring(document)
+    root.set("width", f"{right - left!r}mm")
+    root.set("height", f"{bottom - top!r}mm")
+    root.set("viewBox", f"{left!r} {top!r} {right - left!r} {bottom - top!r}")
+    return etree.tostring(root), left, top
+
+
+def placeable(group: etree._Element) -> bool:
+    """Whether nothing around the instance `group` changes how it's drawn"""
+    for node in (group, *group.iterancestors()):
+        style = parse_style(node.get("style", ""))
+        if any(
+            name in node.attrib or name in style for name in UNPLACEABLE_ATTRIBUTES
+        ):
+            return False
+    return True
+
+
+def place_instances(root: etree._Element, dpi: float) -> list[Placement]:
+    """
+    Takes the instances out of the layer `root` that can be traced once per
+    symbol at `dpi` and placed, drawn with a positive scale and translation
+    and nothing that can't be measured. The others are left in the layer to
+    be traced with the rest of it.
+    """
+    placements = []
+    placed = []
+    with parsed_instances(root) as (svg, instances):
+        for element in svg.select():
+            if not isinstance(element, Group) or INSTANCE_ATTR not in element.values:
+                continue
+            group = instances.groups[int(element.values[INSTANCE_ATTR])]
+            matrix = element.transform
+            if not reifies(matrix) or not placeable(group):
+                continue
+
+            # Only the scale is drawn within the page, which is placed by the
+            # translation
+            page = symbol_page(
+                instances.document(element, Matrix.scale(matrix.a, matrix.d)), dpi
+            )
+            if page is None:
+                continue
+
+            document, left, top = page
+            placements.append(Placement(document, matrix.e + left, matrix.f + top))
+            placed.append(group)
+
+    for group in placed:
+        group.getparent().remove(group)
+    return placements
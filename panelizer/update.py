@@ -1,9 +1,21 @@
+import functools
+import re
+from copy import deepcopy
 from io import BytesIO
+from typing import IO, Iterator, Optional
+from xml.parsers import expat
 
 from lxml import etree
-from lxml.etree import SubElement, _ElementTree
+from lxml.etree import Element, SubElement, _ElementTree
 
-from .create import NS, QName, add_symbols
+from .create import NS, SYMBOLS, QName, add_symbols
+from .metrics import timed
+
+CHUNK_SIZE = 64 * 1024
+
+# A start or end tag, '>' inside quoted attribute values doesn't end it
+TAG = re.compile(rb"""<[^"'>]*(?:(?:"[^"]*"|'[^']*')[^"'>]*)*>""")
+TAG_NAME = re.compile(rb"<([^\s/>]+)")
 
 
 def update_symbols(svg: _ElementTree) -> None:
@@ -23,9 +35,178 @@ def update_symbols(svg: _ElementTree) -> None:
     add_symbols(defs)
 
 
-def update(stream: BytesIO) -> BytesIO:
-    svg = etree.parse(stream)
+def update_tree(stream: IO[bytes]) -> BytesIO:
+    with timed("update_parse"):
+        svg = etree.parse(stream)
+
+    with timed("update_symbols"):
+        update_symbols(svg)
+
+    with timed("update_serialize"):
+        return BytesIO(etree.tostring(svg, pretty_print=True))
+
+
+class DefsRewriter:
+    """
+    Copies a document through, replacing the <symbol> children of its first
+    <defs> with the current symbols. Only the input that may still be rewritten
+    is kept in memory, everything else is passed on byte for byte.
+    """
+
+    def __init__(self, symbols: bytes):
+        self.symbols = symbols
+        self.parser = expat.ParserCreate(namespace_separator=" ")
+        self.parser.StartElementHandler = self.start
+        self.parser.EndElementHandler = self.end
+
+        # Input from `base` onwards, everything before it has been handled
+        self.buffer = bytearray()
+        self.base = 0
+        # Input before `cursor` has been copied to the output or dropped
+        self.cursor = 0
+        self.output: list[bytes] = []
+
+        # Start tag (start, end, self closing) of each open element, what's
+        # needed of a tag is kept here as it may be gone from the buffer by
+        # the time the element ends.
+        self.open: list[tuple[int, int, bool]] = []
+        self.last_tag = 0
+        self.defs_state = "before"
+        self.defs_depth = 0
+        self.defs_tag = b""
+        # End of the last child of <defs> that is kept
+        self.defs_child_end = 0
+        self.dropping: Optional[int] = None
+
+    def tag_end(self, start: int) -> int:
+        return TAG.match(self.buffer, start - self.base).end() + self.base
+
+    def read(self, start: int, end: int) -> bytes:
+        return bytes(self.buffer[start - self.base : end - self.base])
+
+    def copy_to(self, position: int) -> None:
+        self.output.append(self.read(self.cursor, position))
+        self.cursor = position
+
+    def after_children(self, position: int) -> int:
+        """Moves `position` back over the whitespace after the last kept child"""
+        if not self.read(self.defs_child_end, position).strip():
+            return self.defs_child_end
+        return position
+
+    def start(self, name: str, _attributes) -> None:
+        start = self.parser.CurrentByteIndex
+        end = self.tag_end(start)
+        tag = self.read(start, end)
+        self.open.append((start, end, tag.endswith(b"/>")))
+        depth = len(self.open)
+
+        if self.defs_state == "before" and name == f"{NS.svg} defs":
+            self.defs_state = "inside"
+            self.defs_depth = depth
+            self.defs_tag = tag
+            self.defs_child_end = end
+        elif (
+            self.defs_state == "inside"
+            and depth == self.defs_depth + 1
+            and name == f"{NS.svg} symbol"
+        ):
+            # The whitespace before a symbol goes along with it
+            drop = self.after_children(start)
+            self.copy_to(drop)
+            self.dropping = drop
+
+        self.last_tag = end
+
+    def end(self, _name: str) -> None:
+        start, start_end, self_closing = self.open.pop()
+        depth = len(self.open) + 1
+        position = self.parser.CurrentByteIndex
+        end = start_end if self_closing else self.tag_end(position)
+
+        if self.defs_state == "inside" and depth == self.defs_depth + 1:
+            if self.dropping is not None:
+                self.cursor = end
+                self.dropping = None
+            self.defs_child_end = end
+        elif self.defs_state == "inside" and depth == self.defs_depth:
+            if self_closing:
+                tag = self.defs_tag
+                name = TAG_NAME.match(tag).group(1)
+                self.copy_to(start)
+                self.output.append(tag[:-1].rstrip().rstrip(b"/") + b">")
+                self.output.append(self.symbols)
+                self.output.append(b"</" + name + b">")
+                self.cursor = end
+            else:
+                self.copy_to(self.after_children(position))
+                self.output.append(self.symbols)
+            self.defs_state = "done"
+        elif depth == 1 and self.defs_state == "before":
+            self.copy_to(position)
+            self.output.append(b"<defs>" + self.symbols + b"</defs>")
+
+        self.last_tag = max(self.last_tag, end)
+
+    def feed(self, data: bytes, final: bool = False) -> Iterator[bytes]:
+        if self.defs_state == "done":
+            # Nothing after <defs> is rewritten, so the rest isn't even parsed
+            if data:
+                yield data
+            return
+
+        self.buffer += data
+        self.parser.Parse(data, final)
+
+        if final or self.defs_state == "done":
+            self.copy_to(self.base + len(self.buffer))
+        elif self.dropping is not None:
+            self.copy_to(max(self.dropping, self.cursor))
+        elif self.defs_state == "inside":
+            self.copy_to(max(self.defs_child_end, self.cursor))
+        else:
+            self.copy_to(max(self.last_tag, self.cursor))
+
+        del self.buffer[: self.cursor - self.base]
+        self.base = self.cursor
+
+        output, self.output = self.output, []
+        yield from (chunk for chunk in output if chunk)
+
+
+@functools.lru_cache(maxsize=4)
+def serialized_symbols(signature: tuple[tuple[str, int], ...]) -> bytes:
+    """The current symbols, each declaring the namespaces it uses"""
+    chunks = []
+    for template in SYMBOLS.symbols():
+        symbol = Element(
+            QName(NS.svg, "symbol"), attrib=template.attrib, nsmap={None: NS.svg}
+        )
+        symbol.extend(deepcopy(child) for child in template)
+        for element in symbol.iter(etree.Element):
+            if QName(element).namespace is None:
+                element.tag = QName(NS.svg, element.tag)
+        chunks.append(b"\n" + etree.tostring(symbol))
+    return b"".join(chunks)
+
+
+def iter_update(stream: IO[bytes], chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+    """
+    Streams `stream` with its symbols replaced. Documents that aren't in an
+    ASCII compatible encoding are parsed and serialized as a whole instead.
+    """
+    data = stream.read(chunk_size)
+    if data[:2] in (b"\xff\xfe", b"\xfe\xff", b"<\0", b"\0<"):
+        yield update_tree(BytesIO(data + stream.read())).getvalue()
+        return
+
+    rewriter = DefsRewriter(serialized_symbols(SYMBOLS.version()))
+    while data:
+        yield from rewriter.feed(data)
+        data = stream.read(chunk_size)
+    yield from rewriter.feed(b"", final=True)
 
-    update_symbols(svg)
 
-    return BytesIO(etree.tostring(svg, pretty_print=True))
+def update(stream: IO[bytes]) -> BytesIO:
+    with timed("update"):
+        return BytesIO(b"".join(iter_update(stream)))
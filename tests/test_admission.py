@@ -0,0 +1,47 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from panelizer.admission import Admission, Busy, TooExpensive, Unreadable
+from panelizer.cost import Estimate, estimate
+from panelizer.metrics import RSSSampler
+
+
+def cost(memory: int) -> Estimate:
+    return Estimate(10, 10, 1, 1, 0, memory, 0.1)
+
+
+def test_submitted_conversions_hold_the_budget_until_they_finish():
+    admission = Admission(100)
+    release = threading.Event()
+    with ThreadPoolExecutor(2) as executor:
+        admission.submit(executor, cost(60), "first", release.wait)
+        assert admission.in_use == 60
+
+        with pytest.raises(Busy):
+            admission.submit(executor, cost(60), "second", int, timeout=0.01)
+        with pytest.raises(TooExpensive):
+            admission.submit(executor, cost(200), "third", int)
+
+        release.set()
+    assert admission.in_use == 0
+
+
+def test_documents_past_the_parser_limits_are_unreadable():
+    # Deeper than libxml2 allows without huge_tree, as etree.parse() would
+    nested = b"<g>" * 300 + b"</g>" * 300
+    svg = b'<svg xmlns="http://www.w3.org/2000/svg">' + nested + b"</svg>"
+    with pytest.raises(Unreadable):
+        estimate(svg)
+
+
+def test_overlapping_conversions_have_no_memory_of_their_own():
+    sampler = RSSSampler(interval=0.01)
+    alone = sampler.start()
+    assert sampler.stop(alone) >= 0
+
+    first = sampler.start()
+    second = sampler.start()
+    assert sampler.stop(first) is None
+    assert sampler.stop(second) is None
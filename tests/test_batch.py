@@ -0,0 +1,54 @@
+import os
+from concurrent.futures import Future
+from io import BytesIO
+
+from panelizer.batch import BatchResult, convert_batch, write_zip
+from panelizer.pool import RestartingPool
+
+
+class Pool:
+    """Stands in for the worker pool"""
+
+    def __init__(self):
+        self.submitted = 0
+
+    def submit(self, _fn, path: str, svg: bytes) -> Future:
+        self.submitted += 1
+        future: Future = Future()
+        future.set_result(BatchResult(path, svg, None))
+        return future
+
+
+def convert_or_die(path: str, svg: bytes) -> BatchResult:
+    if path == "broken.svg":
+        # As the OOM killer would
+        os._exit(1)
+    return BatchResult(path, svg, None)
+
+
+def test_files_are_read_as_results_are_taken():
+    pool = Pool()
+    files = ((f"{index}.svg", b"") for index in range(10))
+    results = convert_batch(files, pool, max_pending=3)
+
+    for index, result in enumerate(results):
+        assert result.path == f"{index}.svg"
+        assert pool.submitted <= index + 3
+
+
+def test_a_dead_worker_fails_its_file_only():
+    files = [(f"{index}.svg", b"") for index in range(8)]
+    files.insert(3, ("broken.svg", b""))
+
+    with RestartingPool(2) as pool:
+        failed = write_zip(
+            convert_batch(iter(files), pool, convert=convert_or_die), BytesIO()
+        )
+        assert [result.path for result in failed] == ["broken.svg"]
+        assert failed[0].error.startswith("BrokenProcessPool")
+
+        # The next batch finds a working pool
+        files = [("after.svg", b"")]
+        assert list(convert_batch(iter(files), pool, convert=convert_or_die)) == [
+            BatchResult("after.svg", b"", None)
+        ]
@@ -0,0 +1,30 @@
+import pytest
+from svgelements import Path
+
+from panelizer.geometry import ArcTo, path_outlines
+
+
+@pytest.mark.parametrize(
+    "d", ["M 0 0 C 33 0.001 66 0.001 100 0", "M 0 0 C 10 0 20 0 30 0.00001"]
+)
+def test_nearly_straight_curves_are_lines(d: str):
+    (outline,) = path_outlines(Path(d), 0.005)
+    assert not outline.has_arcs()
+
+
+def test_circular_curves_are_arcs():
+    # Quarter circle of radius 10 as drawn by most editors
+    k = 10 * 0.5522847498
+    (outline,) = path_outlines(Path(f"M 10 0 C 10 {k} {k} 10 0 10"), 0.005)
+    (arc,) = outline.pieces
+    assert isinstance(arc, ArcTo)
+    assert arc.end == pytest.approx((0, 10))
+
+
+def test_huge_circular_arcs_are_flattened():
+    (outline,) = path_outlines(Path("M 0 0 A 5000 5000 0 0 1 100 0"), 0.005)
+    assert not outline.has_arcs()
+    assert outline.pieces[-1] == pytest.approx((100, 0))
+
+    (outline,) = path_outlines(Path("M 0 0 A 50 50 0 0 1 100 0"), 0.005)
+    assert outline.has_arcs()
@@ -0,0 +1,29 @@
+from panelizer.metrics import TIMINGS, StageTiming, server_timing, timed
+from panelizer.pool import RestartingPool
+
+
+def timed_in_worker() -> str:
+    with timed("render"):
+        return "traced"
+
+
+def test_repeated_stages_share_an_entry():
+    timings = [
+        StageTiming("render", wall=0.1, cpu=0.05, memory=2048),
+        StageTiming("trace", wall=0.2, cpu=0.2, memory=0),
+        StageTiming("render", wall=0.3, cpu=0.15, memory=1024),
+    ]
+    assert server_timing(timings) == (
+        'render;dur=400.0;desc="2x, cpu 200.0ms, peak +2KiB", '
+        'trace;dur=200.0;desc="1x, cpu 200.0ms, peak +0KiB"'
+    )
+
+
+def test_stages_timed_by_workers_are_recorded():
+    token = TIMINGS.set([])
+    try:
+        with RestartingPool(1) as pool:
+            assert pool.submit(timed_in_worker).result() == "traced"
+        assert [timing.name for timing in TIMINGS.get()] == ["render"]
+    finally:
+        TIMINGS.reset(token)
@@ -0,0 +1,54 @@
+import pytest
+
+convert = pytest.importorskip("panelizer.convert")
+
+
+def board(seed=None):
+    pcb = convert.PCB(title="Untitled Module", company="mlon")
+    pcb.seed = seed
+    pcb.add_circle(1, 2, 3, layer="Edge.Cuts")
+    pcb.add_plated_drill(4, 5, 1, 0.5)
+    return b"".join(pcb.iter_write()).decode("utf-8")
+
+
+def test_seeded_boards_are_undated():
+    written = board(seed="a")
+    assert convert.DETERMINISTIC_DATE in written
+    assert convert.TITLE_DATE.search(written) is None
+    assert board(seed="a") == written
+
+    assert convert.DETERMINISTIC_DATE not in board()
+
+
+def test_placed_modules_are_moved_with_fresh_tstamps():
+    module = convert.PCB(title="Module", company="mlon")
+    module.add_circle(1, 2, 3, layer="Edge.Cuts")
+    module.add_plated_drill(4, 5, 1, 0.5)
+    module.add_literal(
+        str(
+            convert.s.footprint(
+                "Graphics",
+                convert.s.fp_poly(pts=[(0, 0), (1, 0), (1, 1)], layer="F.SilkS"),
+                layer="F.SilkS",
+            )
+        )
+    )
+    placed = b"".join(module.iter_write()).decode("utf-8")
+
+    board = convert.PCB(title="Panel", company="mlon")
+    for offset in [(0, 0), (20, 10)]:
+        board.offset = offset
+        board.place(module.items)
+    written = b"".join(board.iter_write()).decode("utf-8")
+
+    assert "(center 1 2)" in written and "(center 21 12)" in written
+    assert "(at 4 5)" in written and "(at 24 15)" in written
+    assert "(at 0.0 0.0)" in written and "(at 20.0 10.0)" in written
+    # Both pads stay where they are within their footprint
+    assert written.count("(at 0 0)") == 2
+
+    # Including those of pads and of the drawings within traced footprints
+    tstamps = convert.TSTAMP.findall(written)
+    assert len(tstamps) == 2 * len(convert.TSTAMP.findall(placed))
+    assert len(set(tstamps)) == len(tstamps)
+    assert not set(tstamps) & set(convert.TSTAMP.findall(placed))
@@ -0,0 +1,19 @@
+import os
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+
+from panelizer.pool import RestartingPool
+
+
+def die() -> None:
+    # As the OOM killer would
+    os._exit(1)
+
+
+def test_a_dead_worker_only_fails_the_tasks_in_flight():
+    with RestartingPool(2) as pool:
+        with pytest.raises(BrokenProcessPool):
+            pool.submit(die).result()
+
+        assert pool.submit(pow, 2, 10).result() == 1024
@@ -0,0 +1,172 @@
+from io import BytesIO
+
+import pytest
+from lxml import etree
+
+from panelizer.symbols import SYMBOL_ATTR, place_instances
+
+convert = pytest.importorskip("panelizer.convert")
+raster = pytest.importorskip("panelizer.raster")
+create = pytest.importorskip("panelizer.create")
+
+
+@pytest.mark.parametrize("hp", [3, 12])
+def test_created_panels_render_the_holes_once(monkeypatch, hp: int):
+    def rendered_again(*args, **kwargs):
+        raise AssertionError("the holes were rendered again under the relief")
+
+    monkeypatch.setattr(raster, "stack", rendered_again)
+    monkeypatch.setattr(raster, "trace_svg", rendered_again)
+    # Coarse enough to keep the test quick, the regions are found the same way
+    monkeypatch.setattr(convert, "DPI", 254)
+
+    svg = etree.parse(BytesIO(create.create_document(hp).content))
+    convert.inline_symbols(svg.getroot())
+    layers = convert.split_layers(svg.getroot(), convert.CONVERTED_LAYERS)
+    pcb = convert.PCB(title="Untitled Module")
+    convert.add_copper_layers(pcb, svg, layers)
+
+    back, front = (item.val for item in pcb.items)
+    assert '"B.Cu"' in back
+    assert '"F.Cu"' in front
+    assert back != front
+
+
+def test_tiles_fit_a_budget_smaller_than_a_row():
+    region = raster.Region(left=0, top=0, right=10000, bottom=300)
+    # 4096 pixels, less than the 10000 of a single row
+    budget = 4096 * raster.BYTES_PER_PIXEL
+    tiles = raster.tiles(region, dpi=254, memory_budget=budget)
+
+    traced = 0
+    for tile in tiles:
+        rendered = tile.rendered
+        assert raster.contains(rendered, tile.traced)
+        assert (rendered.right - rendered.left) * (
+            rendered.bottom - rendered.top
+        ) * raster.BYTES_PER_PIXEL <= budget
+        traced += (tile.traced.right - tile.traced.left) * (
+            tile.traced.bottom - tile.traced.top
+        )
+    assert traced == 10000 * 300
+
+    with pytest.raises(ValueError, match="memory budget"):
+        raster.tiles(region, dpi=2540, memory_budget=budget)
+
+
+def test_tiles_trace_the_same_outlines_as_a_single_render():
+    svg = etree.ElementTree(
+        etree.fromstring(
+            b'<svg xmlns="http://www.w3.org/2000/svg" width="20mm" height="4mm"'
+            b' viewBox="0 0 20 4"><circle cx="10" cy="2" r="1.5"/>'
+            b'<rect x="2" y="1" width="4" height="2"/></svg>'
+        )
+    )
+    # 10 pixels per mm
+    region = raster.Region(left=0, top=0, right=200, bottom=40)
+    options = dict(invert=False, dpi=254)
+
+    whole = raster.trace_region(svg, region, memory_budget=10**9, **options)
+    tiled = raster.trace_region(
+        svg, region, memory_budget=400 * raster.BYTES_PER_PIXEL, **options
+    )
+    assert len(tiled) == len(whole) == 2
+    assert sum(poly.area() for poly in tiled) == pytest.approx(
+        sum(poly.area() for poly in whole), rel=0.01
+    )
+
+
+FRONT = b"""<svg xmlns="http://www.w3.org/2000/svg"
+    xmlns:inkscape="http://www.inkscape.org/namespaces/inkscape"
+    width="40mm" height="20mm" viewBox="0 0 40 20">
+  <g inkscape:label="Front" inkscape:groupmode="layer">
+    <text x="2" y="6" style="font-family:Jost;font-size:4px">mlon</text>
+    <path d="M 20 4 L 36 4" fill="none" stroke="#000" stroke-width="1.5"/>
+    <rect x="4" y="12" width="8" height="4"/>
+    <path d="M 20 14 L 36 17" fill="none" stroke="#000" stroke-width="2"
+        stroke-linecap="round"/>
+  </g>
+</svg>"""
+
+
+def test_front_batches_trace_what_the_whole_layer_does(monkeypatch):
+    monkeypatch.setattr(convert, "DPI", 254)
+    svg = etree.parse(BytesIO(FRONT))
+    front = convert.layer_root(svg, None, "Front")
+
+    batched = convert.PCB(title="Front")
+    convert.add_front_layer(batched, svg)
+    whole = convert.PCB(title="Front")
+    convert.raster_svg(whole, etree.ElementTree(front), "F.SilkS", dpi=254)
+
+    def outlines(pcb) -> tuple[int, int]:
+        traced = "".join(item.val for item in pcb.items)
+        return traced.count("(fp_poly"), traced.count("(xy ")
+
+    polys, points = outlines(whole)
+    batched_polys, batched_points = outlines(batched)
+    assert batched_polys == polys
+    assert batched_points == pytest.approx(points, rel=0.02)
+
+
+HOLES = f"""<svg xmlns="http://www.w3.org/2000/svg" width="20mm" height="10mm"
+    viewBox="0 0 20 10">
+  <rect x="0.5" y="0.5" width="19" height="9" fill="#fff"/>
+  <g transform="translate(2 2)" {SYMBOL_ATTR}="hole">
+    <circle cx="1.5" cy="1.5" r="1.5" fill="#000"/>
+  </g>
+  <rect x="8" y="3" width="3" height="4" fill="#000"/>
+  <g transform="translate(14.23 4.71)" {SYMBOL_ATTR}="hole">
+    <circle cx="1.5" cy="1.5" r="1.5" fill="#000"/>
+  </g>
+</svg>""".encode()
+
+
+def test_placed_symbols_are_cut_out_like_rendered_ones():
+    svg = etree.ElementTree(etree.fromstring(HOLES))
+    # 10 pixels per mm
+    page = raster.Region(left=0, top=0, right=200, bottom=100)
+    options = dict(invert=True, dpi=254, memory_budget=10**9)
+    whole = raster.trace_region(svg, page, **options)
+
+    raster.trace_symbol.cache_clear()
+    placed = place_instances(svg.getroot(), 254)
+    polys = raster.place(raster.trace_region(svg, page, **options), placed, **options)
+
+    assert len(placed) == 2
+    # Both instances are traced from the same page
+    assert raster.trace_symbol.cache_info().currsize == 1
+    assert sum(poly.area() for poly in polys) == pytest.approx(
+        sum(poly.area() for poly in whole), rel=0.01
+    )
+
+
+# Sizes that aren't a whole number of pixels once converted to mm and back
+SQUARE = (
+    b'<svg xmlns="http://www.w3.org/2000/svg" width="20mm" height="20mm"'
+    b' viewBox="0 0 20 20"><rect width="20" height="20"/></svg>'
+)
+
+
+@pytest.mark.parametrize("dpi", [317.5, 600, 1270])
+@pytest.mark.parametrize("size", [29, 53, 63, 116])
+def test_regions_render_to_their_exact_pixels(dpi: float, size: int):
+    svg = etree.ElementTree(etree.fromstring(SQUARE))
+    region = raster.Region(left=size, top=size, right=2 * size, bottom=2 * size + 1)
+
+    bitmap = raster.mask(raster.render_region(svg, region, invert=False, dpi=dpi))
+    assert bitmap.shape == (size + 1, size)
+    assert bitmap.all()
+
+
+def test_tiles_leave_no_seams():
+    svg = etree.ElementTree(etree.fromstring(SQUARE))
+    region = raster.Region(left=0, top=0, right=232, bottom=207)
+    # Squares of 29 pixels, with 25 pixels of overlap around them
+    budget = (29 + 2 * 25) ** 2 * raster.BYTES_PER_PIXEL
+
+    polys = raster.trace_region(
+        svg, region, invert=False, dpi=1270, memory_budget=budget
+    )
+    assert len(polys) == 1
+    assert polys[0].area() == pytest.approx(232 * 207)
@@ -0,0 +1,51 @@
+import os
+
+import pytest
+from lxml import etree
+
+# cairosvg is the reference the other backends are compared against
+pytest.importorskip("cairosvg")
+rasterizers = pytest.importorskip("panelizer.rasterizers")
+parity = pytest.importorskip("benchmarks.parity")
+
+# Same as the defaults of benchmarks/parity.py
+PARITY_DPI = 1270
+PARITY_TOLERANCE = 0.01
+
+
+@pytest.mark.parametrize("dpi", [254, 317.5, 2540])
+def test_vips_renders_at_the_requested_dpi(dpi: float):
+    svg = (
+        b'<svg xmlns="http://www.w3.org/2000/svg" width="15mm" height="10mm"'
+        b' viewBox="0 0 15 10"><rect width="5" height="5"/></svg>'
+    )
+    vips = rasterizers.VipsRasterizer()
+    bitmap = vips.mask(vips.render(svg, dpi=dpi))
+
+    px_per_mm = dpi / 25.4
+    assert bitmap.shape == (round(10 * px_per_mm), round(15 * px_per_mm))
+    assert bitmap.sum() == pytest.approx((5 * px_per_mm) ** 2, rel=0.01)
+
+
+@pytest.mark.parametrize(
+    "symbol_file", [symbol_file for symbol_file, _ in parity.SYMBOLS.scan()]
+)
+def test_vips_matches_cairosvg_on_the_symbols(symbol_file: str):
+    path = os.path.join(parity.SYMBOLS.directory, symbol_file)
+    layers = parity.split_layers(
+        etree.parse(path).getroot(),
+        [(label, fill) for label, fill, _ in parity.LAYERS],
+    )
+    cairo, vips = rasterizers.CairoRasterizer(), rasterizers.VipsRasterizer()
+
+    for label, fill, invert in parity.LAYERS:
+        layer = layers[(label, fill)]
+        if layer is None:
+            continue
+
+        svg = etree.tostring(layer)
+        ratio = parity.difference(
+            parity.bitmap(cairo, svg, PARITY_DPI, invert),
+            parity.bitmap(vips, svg, PARITY_DPI, invert),
+        )
+        assert ratio <= PARITY_TOLERANCE, f"{label} differs on {ratio:.2%}"
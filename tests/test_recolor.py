@@ -0,0 +1,91 @@
+import html
+from typing import Optional
+
+import pytest
+
+from panelizer.styles import recolor_style
+
+cssutils = pytest.importorskip("cssutils")
+
+
+def cssutils_style(
+    style: str, fill: Optional[str], stroke: Optional[str], force_fill: bool
+) -> str:
+    """recolor_style as it was written with cssutils"""
+    declarations = cssutils.parseStyle(style, validate=False)
+
+    if fill is not None:
+        declarations["fill"] = fill
+    fill = declarations["fill"]
+    if force_fill or (fill != "" and fill is not None and fill != "none"):
+        declarations["fill"] = "#000"
+
+    if stroke is not None:
+        declarations["stroke"] = stroke
+    stroke = declarations["stroke"]
+    if stroke != "" and stroke is not None and stroke != "none":
+        declarations["stroke"] = "#000"
+
+    return canonical(declarations.getCssText(separator=""))
+
+
+def canonical(style: str) -> str:
+    text = cssutils.parseStyle(style, validate=False).getCssText(separator="")
+    return html.unescape(text).replace('"', "'").replace(": ", ":")
+
+
+@pytest.mark.parametrize(
+    "style",
+    [
+        "",
+        "fill:#ff0000;stroke:none;stroke-width:0.26458332",
+        "fill:none;stroke:#00ff00;stroke-linecap:round",
+        "font-family:'Open Sans';fill:#333333",
+        'font-family:"DejaVu Sans, Bold";font-size:2.8px;fill:#333333',
+        "fill:url(#pattern);mask:url(data:image/png;base64,iVBORw0KGgo=)",
+        "stroke:url('data:image/svg+xml;utf8,x;y');fill:none",
+        "fill:#ff0000 !important;stroke:blue",
+        "stroke:blue !important;opacity:0.5",
+        "FILL:Red; stroke : none ;",
+    ],
+)
+@pytest.mark.parametrize(
+    "fill, stroke", [(None, None), ("red", None), (None, "#123"), ("red", "#123")]
+)
+@pytest.mark.parametrize("force_fill", [False, True])
+def test_matches_cssutils(
+    style: str, fill: Optional[str], stroke: Optional[str], force_fill: bool
+):
+    # cssutils rewrites the values it serializes (it rounds numbers to six
+    # digits, quotes URLs and spaces declarations) where recolor_style keeps
+    # them as written, so both are compared as cssutils reads them back. The
+    # raw strings are checked by test_keeps_values_as_written.
+    recolored = recolor_style(style, fill, stroke, force_fill)
+    assert canonical(recolored) == cssutils_style(style, fill, stroke, force_fill)
+
+
+@pytest.mark.parametrize(
+    "style, expected",
+    [
+        ("", ""),
+        (
+            "fill:#ff0000;stroke:none;stroke-width:0.26458332",
+            "fill:#000;stroke:none;stroke-width:0.26458332",
+        ),
+        ("FILL:Red; stroke : blue ;", "fill:#000;stroke:#000"),
+        (
+            'font-family:"DejaVu Sans, Bold";fill:none',
+            "font-family:'DejaVu Sans, Bold';fill:none",
+        ),
+        (
+            "stroke:url('data:image/svg+xml;utf8,x;y');fill:none",
+            "stroke:#000;fill:none",
+        ),
+        (
+            "mask:url(data:image/png;base64,iVBORw0KGgo=);/* x */fill:red",
+            "mask:url(data:image/png;base64,iVBORw0KGgo=);fill:#000",
+        ),
+    ],
+)
+def test_keeps_values_as_written(style: str, expected: str):
+    assert recolor_style(style, None, None, False) == expected
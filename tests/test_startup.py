@@ -0,0 +1,44 @@
+import json
+import os
+import subprocess
+import sys
+
+from benchmarks.importtime import LAZY, STARTUP, measure
+
+
+def test_conversion_stack_loads_lazily():
+    result = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            f"{STARTUP}; import json, sys; print(json.dumps(sorted(sys.modules)))",
+        ],
+        capture_output=True,
+        text=True,
+        check=True,
+        env={**os.environ, "PANELIZER_PREWARM": "0"},
+    )
+    modules = json.loads(result.stdout.splitlines()[-1])
+
+    eager = [
+        module
+        for module in modules
+        if any(module == lazy or module.startswith(f"{lazy}.") for lazy in LAZY)
+    ]
+    assert eager == []
+
+
+def test_startup_importtime_leaves_out_the_conversion_stack():
+    # The same `python -X importtime` run as benchmarks/importtime.py
+    imports = measure()
+    assert imports
+
+    eager = [
+        entry.module
+        for entry in imports
+        if any(
+            entry.module == lazy or entry.module.startswith(f"{lazy}.")
+            for lazy in LAZY
+        )
+    ]
+    assert eager == []
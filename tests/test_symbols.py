@@ -0,0 +1,104 @@
+from io import BytesIO
+
+import pytest
+from lxml import etree
+from svgelements import SVG, Circle, Path, Rect
+
+from panelizer.symbols import SYMBOL_ATTR, place_instances, select_shapes
+
+TYPES = (Circle, Path, Rect)
+
+
+def document(transform: str) -> bytes:
+    instance = f"""
+        <g transform="{transform}" {SYMBOL_ATTR}="jack">
+            <g transform="translate(1 2) scale(2)">
+                <rect x="0" y="0" width="3" height="2"/>
+                <circle cx="1" cy="1" r="1"/>
+                <path d="M 0 0 L 3 4"/>
+            </g>
+        </g>
+    """
+    return f"""
+        <svg xmlns="http://www.w3.org/2000/svg">
+            <g>{instance}<circle cx="9" cy="9" r="2"/>{instance}</g>
+        </svg>
+    """.encode()
+
+
+def described(shape) -> tuple:
+    if isinstance(shape, Path):
+        return ("path", shape.d())
+    matrix = shape.transform
+    return (
+        type(shape).__name__,
+        shape.bbox(),
+        (matrix.a, matrix.b, matrix.c, matrix.d, matrix.e, matrix.f),
+    )
+
+
+@pytest.mark.parametrize(
+    "transform",
+    [
+        "translate(5 5)",
+        "scale(2 0.5) translate(3 1)",
+        "rotate(30) translate(5 5)",
+        "scale(1 -1)",
+        "matrix(0 1 -1 0 3 3)",
+        "translate(4 4) skewX(10)",
+    ],
+)
+def test_instances_match_parsing_the_layer(transform: str):
+    svg = document(transform)
+    parsed = SVG.parse(BytesIO(svg), ppi=25.4).select(lambda el: isinstance(el, TYPES))
+    shapes = select_shapes(etree.fromstring(svg), TYPES)
+    assert [described(shape) for shape in shapes] == [
+        described(shape) for shape in parsed
+    ]
+
+
+def test_the_layer_is_left_as_it_is():
+    root = etree.fromstring(document("translate(5 5)"))
+    before = etree.tostring(root)
+    list(select_shapes(root, TYPES))
+    assert etree.tostring(root) == before
+
+
+def test_only_upright_unclipped_instances_are_placed():
+    root = etree.fromstring(
+        f"""
+        <svg xmlns="http://www.w3.org/2000/svg" width="20mm" height="20mm"
+            viewBox="0 0 20 20">
+            <g transform="translate(5 5) scale(2)" {SYMBOL_ATTR}="hole">
+                <circle cx="1" cy="1" r="1"/>
+            </g>
+            <g transform="rotate(90 10 10)" {SYMBOL_ATTR}="hole">
+                <circle cx="1" cy="1" r="1"/>
+            </g>
+            <g clip-path="url(#clip)">
+                <g transform="translate(1 1)" {SYMBOL_ATTR}="hole">
+                    <circle cx="1" cy="1" r="1"/>
+                </g>
+            </g>
+        </svg>
+        """.encode()
+    )
+    # 10 pixels per mm
+    placements = place_instances(root, 254)
+
+    assert len(placements) == 1
+    document, x, y = placements[0]
+    # A pixel of margin around the circle, 4mm across once scaled
+    page = etree.fromstring(document)
+    left, top, width, height = (float(v) for v in page.get("viewBox").split())
+    assert (left, top) == pytest.approx((-0.1, -0.1))
+    # svgelements scales millimetres by slightly more than 1, up to a pixel more
+    assert (width, height) == pytest.approx((4.2, 4.2), abs=0.1)
+    assert (x, y) == pytest.approx((4.9, 4.9))
+
+    kept = root.xpath(f"//*[@{SYMBOL_ATTR}]")
+    assert [group.get("transform") for group in kept] == [
+        "rotate(90 10 10)",
+        "translate(1 1)",
+    ]
+    assert all(len(group) == 1 for group in kept)
@@ -0,0 +1,72 @@
+from io import BytesIO
+
+import pytest
+from lxml import etree
+
+from panelizer.update import CHUNK_SIZE, iter_update, update_tree
+
+HEAD = (
+    b'<?xml version="1.0" encoding="UTF-8"?>\n'
+    b'<svg xmlns="http://www.w3.org/2000/svg" '
+    b'xmlns:xlink="http://www.w3.org/1999/xlink" width="10mm" height="10mm">\n'
+)
+
+DOCUMENTS = {
+    "symbols": HEAD
+    + b'  <defs id="d" data-x="a > b">\n'
+    + b'    <linearGradient id="g"><stop offset="0"/></linearGradient>\n'
+    + b'    <symbol id="old"><path d="M 0 0 L 1 1"/></symbol>\n'
+    + b"    <!-- kept -->\n"
+    + b'    <symbol id="older"/>\n'
+    + b"  </defs>\n"
+    + b'  <use xlink:href="#old"/>\n'
+    + b"</svg>\n",
+    "self_closing_defs": HEAD
+    + b'  <g id="a"><rect width="1" height="1"/></g>\n'
+    + b'  <defs id="d" />\n'
+    + b"  <text>after</text>\n"
+    + b"</svg>\n",
+    "no_defs": HEAD + b'  <g><rect width="1" height="1"/></g>\n</svg>\n',
+}
+
+
+def canonical(document: bytes) -> bytes:
+    parser = etree.XMLParser(remove_blank_text=True)
+    return etree.tostring(etree.fromstring(document, parser), method="c14n")
+
+
+def streamed(document: bytes, chunk_size: int) -> bytes:
+    return b"".join(iter_update(BytesIO(document), chunk_size))
+
+
+@pytest.mark.parametrize("name", DOCUMENTS)
+def test_every_chunk_size_matches_update_tree(name: str):
+    document = DOCUMENTS[name]
+    expected = canonical(update_tree(BytesIO(document)).getvalue())
+    whole = streamed(document, len(document))
+    assert canonical(whole) == expected
+
+    for chunk_size in range(1, len(document) + 1):
+        assert streamed(document, chunk_size) == whole, chunk_size
+
+
+@pytest.mark.parametrize("shift", range(4))
+@pytest.mark.parametrize("before_boundary", [1, 6, 130])
+def test_defs_across_default_chunk(before_boundary: int, shift: int):
+    # <defs> starts just before the first chunk ends, and the start tags it
+    # leaves behind are long gone from the buffer when it ends in the next one
+    padding = CHUNK_SIZE - len(HEAD) - len(b"<!---->") - before_boundary
+    document = (
+        HEAD
+        + b"<!--"
+        + b" " * padding
+        + b'--><defs id="d"><linearGradient id="g"/><symbol id="old"><title>'
+        + b"x" * 256
+        + b"</title></symbol></defs>"
+        + b" " * shift
+        + b"<g/>" * (CHUNK_SIZE // 4)
+        + b"</svg>"
+    )
+    assert canonical(streamed(document, CHUNK_SIZE)) == canonical(
+        update_tree(BytesIO(document)).getvalue()
+    )